@@ -24,6 +24,9 @@ c.DockerSpawner.image = "radiasoft/beamsim-jupyter"
 # needs to be true b/c create_object will invoke port bindings otherwise
 c.DockerSpawner.use_internal_ip = True
 c.DockerSpawner.network_name = "host"
+# cfg may also be the name of a file containing this JSON. Then the pools
+# are reloaded without restarting the hub when the file changes (checked
+# every reload_secs) or the hub receives SIGHUP. Inline JSON is fixed.
 c.RSDockerSpawner.cfg = (
     '''{
     "port_base": 8100,
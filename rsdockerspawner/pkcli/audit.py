@@ -0,0 +1,73 @@
+"""Report drift between the pools snapshot and containers on the hosts
+
+Reads the pools file written by the hub and lists labeled containers
+on every host concurrently. The comparison is the same as the hub's
+auditor (see `rsdockerspawner.rsdockerspawner.audit_host`), but
+nothing is changed, e.g.::
+
+    rsdockerspawner audit /srv/jupyterhub/docker_tls --pools-file=/srv/jupyterhub/rsdockerspawner_pools.json
+
+The file is written at most pools_dump_secs after a change so spawns
+in progress may be reported.
+
+:copyright: Copyright (c) 2026 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+
+from pykern import pkio
+from pykern import pkjson
+from rsdockerspawner import rsdockerspawner
+import concurrent.futures
+
+
+def default_command(tls_dir, pools_file=rsdockerspawner._POOLS_DUMP_FILE):
+    """Compare slots in pools_file with the containers on their hosts
+
+    Args:
+        tls_dir (str): directory with certs for each host (same as cfg)
+        pools_file (str): written by the hub
+    Returns:
+        str: drift (one line each) and a summary
+    """
+
+    def _containers(host):
+        try:
+            return rsdockerspawner.docker_client(host, d).containers(
+                all=True,
+                filters={"label": rsdockerspawner._PORT_LABEL},
+            )
+        except Exception as e:
+            return e
+
+    d = pkio.py_path(tls_dir)
+    s = [
+        rsdockerspawner._Slot.from_dump(x)
+        for p in pkjson.load_any(pkio.py_path(pools_file)).values()
+        for x in p.get("slots") or []
+    ]
+    h = sorted(set(x.host for x in s))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(h), 1)) as e:
+        c = list(e.map(_containers, h))
+    res = []
+    n = [0, 0, 0]
+    for x, y in zip(h, c):
+        if isinstance(y, Exception):
+            n[2] += 1
+            res.append(f"error host={x} error={y}")
+            continue
+        a = rsdockerspawner.audit_host(x, s, y)
+        n[0] += len(a.orphans)
+        n[1] += len(a.vanished)
+        for o in a.orphans:
+            res.append(
+                f"orphan host={x} cname={o['Names'][0]} cid={o['Id'][:12]}"
+                + f" port={o['Labels'].get(rsdockerspawner._PORT_LABEL)} state={o['State']}"
+            )
+        for v in a.vanished:
+            res.append(
+                f"vanished host={x} slot={v.num} port={v.port} cname={v.cname} cid={v.cid[:12]}"
+            )
+    res.append(
+        f"hosts={len(h)} slots={len(s)} orphans={n[0]} vanished={n[1]} errors={n[2]}"
+    )
+    return "\n".join(res)
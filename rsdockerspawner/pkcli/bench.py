@@ -0,0 +1,679 @@
+"""Benchmark RSDockerSpawner against fake docker hosts
+
+Runs offline in a single process. Each host's docker.APIClient is
+replaced by an in-process fake with configurable latency and failure
+rate. Workloads are run through `RSDockerSpawner` and report
+throughput and p50/p99 latencies, e.g.::
+
+    rsdockerspawner bench spawn_storm --users=500 --hosts=8 --latency=0.01
+
+Hosts are named 127.0.0.N so they resolve without DNS. Each command
+should be run in its own process, because spawner state is per class.
+
+:copyright: Copyright (c) 2026 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+
+from pykern import pkio
+from pykern import pkjson
+from pykern.pkcollections import PKDict
+import asyncio
+import datetime
+import docker
+import logging
+import queue
+import random
+import requests
+import tempfile
+import threading
+import time
+import types
+
+#: Value of RSDockerSpawner.image
+_IMAGE = "radiasoft/bench:latest"
+
+#: Port of the first slot on each host
+_PORT_BASE = 8100
+
+
+def gc(
+    users=32,
+    hosts=4,
+    servers_per_host=8,
+    latency=0.005,
+    failure_rate=0.0,
+):
+    """Spawn users into a full pool so every spawn runs __pool_gc
+
+    The pool is filled with users inactive for two hours. Then users
+    are spawned one at a time, each evicting the least active. Only
+    hosts * servers_per_host users can be evicted.
+
+    Args:
+        users (int): users spawned after the pool is full
+        hosts (int): fake docker hosts
+        servers_per_host (int): slots per host
+        latency (float): seconds per docker call
+        failure_rate (float): fraction of docker calls which fail
+    Returns:
+        str: report
+    """
+
+    async def _run(b):
+        o = datetime.datetime.now() - datetime.timedelta(hours=2)
+        for s in [b.spawner(f"old{i}", last_activity=o) for i in range(b.capacity)]:
+            await s.start()
+            # sets activity_secs from last_activity
+            await s.poll()
+        b.calls_reset()
+        r = await b.measure(
+            [b.spawner(f"u{i}") for i in range(users)],
+            lambda s: s.start(),
+            concurrent=False,
+        )
+        n = sum(h.removed for h in b.hosts.values())
+        b.check(n == min(users, b.capacity), f"evictions={n}")
+        return r
+
+    return _Bench(
+        hosts=hosts,
+        servers_per_host=servers_per_host,
+        latency=latency,
+        failure_rate=failure_rate,
+        min_activity_hours=1,
+    ).run("gc", _run)
+
+
+def gpus(
+    users=16,
+    hosts=4,
+    servers_per_host=8,
+    gpus_per_host=4,
+    discover=False,
+    latency=0.005,
+    failure_rate=0.0,
+):
+    """Start users concurrently in a pool with one GPU per server
+
+    Hosts have fewer GPUs than slots. A host fails a start if the
+    container requests a device which a running container has.
+
+    Args:
+        users (int): users started at once
+        hosts (int): fake docker hosts
+        servers_per_host (int): slots per host
+        gpus_per_host (int): devices on each host
+        discover (bool): devices from docker info instead of gpu_devices
+        latency (float): seconds per docker call
+        failure_rate (float): fraction of docker calls which fail
+    Returns:
+        str: report
+    """
+
+    async def _run(b):
+        r = await b.measure(
+            [b.spawner(f"u{i}") for i in range(users)],
+            lambda s: s.start(),
+        )
+        n = b.running()
+        b.check(n == min(users, b.capacity, hosts * gpus_per_host), f"running={n}")
+        return r
+
+    return _Bench(
+        hosts=hosts,
+        servers_per_host=servers_per_host,
+        gpus=1,
+        gpus_per_host=gpus_per_host,
+        gpu_discover=discover,
+        latency=latency,
+        failure_rate=failure_rate,
+    ).run("gpus", _run)
+
+
+def poll(
+    users=200,
+    rounds=10,
+    hosts=4,
+    servers_per_host=64,
+    latency=0.005,
+    failure_rate=0.0,
+    poll_cache_secs=0.0,
+    docker_events=False,
+):
+    """Poll running servers like JupyterHub does
+
+    Args:
+        users (int): running servers
+        rounds (int): times all servers are polled concurrently
+        hosts (int): fake docker hosts
+        servers_per_host (int): slots per host
+        latency (float): seconds per docker call
+        failure_rate (float): fraction of docker calls which fail
+        poll_cache_secs (float): see `RSDockerSpawner.poll`
+        docker_events (bool): follow docker events
+    Returns:
+        str: report
+    """
+
+    async def _poll(spawner):
+        r = await spawner.poll()
+        if r is not None:
+            raise AssertionError(f"user={spawner.user.name} poll={r} not running")
+
+    async def _run(b):
+        s = [b.spawner(f"u{i}") for i in range(users)]
+        for x in s:
+            await x.start()
+        # events threads need to connect
+        await asyncio.sleep(0.1)
+        b.calls_reset()
+        r = await b.measure(s, _poll, rounds=rounds)
+        b.check(not r.errors, f"errors={len(r.errors)}")
+        return r
+
+    return _Bench(
+        hosts=hosts,
+        servers_per_host=servers_per_host,
+        latency=latency,
+        failure_rate=failure_rate,
+        docker_events=docker_events,
+        poll_cache_secs=poll_cache_secs,
+    ).run("poll", _run)
+
+
+def restart(
+    users=500,
+    orphans=50,
+    hosts=16,
+    servers_per_host=64,
+    latency=0.05,
+    failure_rate=0.0,
+):
+    """Reconcile hosts full of containers as after a hub restart
+
+    Containers for users and orphans (ports without a slot) are
+    created on the hosts before the spawner initializes.
+
+    Args:
+        users (int): running containers with slots
+        orphans (int): running containers without slots
+        hosts (int): fake docker hosts
+        servers_per_host (int): slots per host
+        latency (float): seconds per docker call
+        failure_rate (float): fraction of docker calls which fail
+    Returns:
+        str: report
+    """
+
+    async def _run(b):
+        h = list(b.hosts.values())
+        for i in range(users):
+            h[i % len(h)].container_add(
+                f"jupyter-u{i}",
+                _PORT_BASE + (i // len(h)) % servers_per_host,
+            )
+        for i in range(orphans):
+            h[i % len(h)].container_add(
+                f"jupyter-orphan{i}",
+                _PORT_BASE + servers_per_host + i,
+            )
+        b.calls_reset()
+        r = await b.measure([b.spawner("u0")], lambda x: x.poll())
+        n = (b.running("jupyter-u"), b.running("jupyter-orphan"))
+        b.check(n == (users, 0), f"users={n[0]} orphans={n[1]}")
+        return r
+
+    return _Bench(
+        hosts=hosts,
+        servers_per_host=servers_per_host,
+        latency=latency,
+        failure_rate=failure_rate,
+    ).run("restart", _run)
+
+
+def spawn_storm(
+    users=200,
+    hosts=4,
+    servers_per_host=64,
+    latency=0.005,
+    failure_rate=0.0,
+):
+    """Start users concurrently as at the start of a workshop
+
+    Args:
+        users (int): users started at once
+        hosts (int): fake docker hosts
+        servers_per_host (int): slots per host
+        latency (float): seconds per docker call
+        failure_rate (float): fraction of docker calls which fail
+    Returns:
+        str: report
+    """
+
+    async def _run(b):
+        r = await b.measure(
+            [b.spawner(f"u{i}") for i in range(users)],
+            lambda s: s.start(),
+        )
+        n = b.running()
+        b.check(n == min(users, b.capacity), f"running={n}")
+        return r
+
+    return _Bench(
+        hosts=hosts,
+        servers_per_host=servers_per_host,
+        latency=latency,
+        failure_rate=failure_rate,
+    ).run("spawn_storm", _run)
+
+
+class _Bench(PKDict):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pksetdefault(
+            cfg_file=False,
+            docker_events=False,
+            extra_cfg=PKDict,
+            gpu_discover=False,
+            gpus=0,
+            gpus_per_host=0,
+            min_activity_hours=1e6,
+            poll_cache_secs=0.0,
+            pool=PKDict,
+        )
+        self.capacity = self.hosts * self.servers_per_host
+        # errors are in the report
+        self._log = logging.getLogger("rsdockerspawner.bench")
+        self._log.addHandler(logging.NullHandler())
+        self._log.propagate = False
+        self.hosts = PKDict(
+            (f"127.0.0.{i + 1}", _FakeHost(self, f"127.0.0.{i + 1}"))
+            for i in range(self.hosts)
+        )
+
+    def calls_reset(self):
+        for h in self.hosts.values():
+            h.calls = 0
+            h.removed = 0
+
+    def check(self, ok, msg):
+        """Workload did what it claims (unless failures are injected)
+
+        Args:
+            ok (bool): expected outcome
+            msg (str): describes actual outcome
+        """
+        if not ok and not self.failure_rate:
+            raise AssertionError(f"unexpected outcome: {msg}")
+
+    async def measure(self, spawners, op, concurrent=True, rounds=1):
+        async def _one(spawner):
+            t = time.monotonic()
+            try:
+                await op(spawner)
+                return time.monotonic() - t, None
+            except Exception as e:
+                return time.monotonic() - t, e
+
+        r = []
+        t = time.monotonic()
+        # a spawner is never called concurrently with itself
+        for _ in range(rounds):
+            if concurrent:
+                r.extend(await asyncio.gather(*(_one(s) for s in spawners)))
+            else:
+                r.extend([await _one(s) for s in spawners])
+        return PKDict(
+            errors=[e for _, e in r if e],
+            latencies=sorted(x for x, _ in r),
+            secs=time.monotonic() - t,
+        )
+
+    def running(self, prefix=""):
+        """Number of running containers whose names start with prefix"""
+        return sum(h.running(prefix) for h in self.hosts.values())
+
+    def execute(self, workload):
+        """Call workload with spawners configured for the fake hosts
+
+        Args:
+            workload (coroutine function): called with self
+        Returns:
+            object: returned by workload
+        """
+        from rsdockerspawner import rsdockerspawner
+
+        async def _run():
+            try:
+                return await workload(self)
+            finally:
+                # pools dump must be written before leaving the directory
+                await asyncio.sleep(0.1)
+                s._RSDockerSpawner__pools_dump_flush()
+
+        s = rsdockerspawner.RSDockerSpawner
+        # the only seam: every docker call goes through __docker_client
+        s._RSDockerSpawner__docker_client = classmethod(
+            lambda cls, host: self.hosts[host]
+        )
+        with tempfile.TemporaryDirectory() as d, pkio.save_chdir(d):
+            p = PKDict(
+                hosts=list(self.hosts.keys()),
+                min_activity_hours=self.min_activity_hours,
+                servers_per_host=self.servers_per_host,
+            )
+            if self.gpus:
+                p.gpus = self.gpus
+            p.update(self.pool)
+            self.cfg = pkjson.dump_pretty(
+                PKDict(
+                    docker_events=self.docker_events,
+                    gpu_devices=PKDict(
+                        (h, v.gpus)
+                        for h, v in self.hosts.items()
+                        if not self.gpu_discover
+                    ),
+                    poll_cache_secs=self.poll_cache_secs,
+                    pools=PKDict(everybody=p),
+                    pools_dump_secs=0.05,
+                    port_base=_PORT_BASE,
+                    tls_dir=str(self._tls_dir(d)),
+                    user_groups=PKDict(),
+                    volumes=PKDict({f"{d}/user/{{username}}": PKDict(bind="/home")}),
+                ).pkupdate(self.extra_cfg),
+            )
+            if self.cfg_file:
+                # so the spawner can reload it
+                f = pkio.py_path(d).join("cfg.json")
+                pkio.write_text(f, self.cfg)
+                self.cfg = str(f)
+            return asyncio.run(_run())
+
+    def run(self, name, workload):
+        return self._report(name, self.execute(workload))
+
+    def spawner(self, user, last_activity=None):
+        from rsdockerspawner import rsdockerspawner
+
+        res = rsdockerspawner.RSDockerSpawner(
+            cfg=self.cfg,
+            hub=types.SimpleNamespace(
+                api_url="http://127.0.0.1:8081/hub/api",
+                base_url="/hub/",
+                public_host="",
+                url="http://127.0.0.1:8081/hub/",
+            ),
+            image=_IMAGE,
+            log=self._log,
+            network_name="host",
+            remove=True,
+            use_internal_ip=True,
+            user=_User(user, last_activity),
+        )
+        res.api_token = "bench"
+        return res
+
+    def _report(self, name, result):
+        def _pct(p):
+            l = result.latencies
+            return l[int(p * (len(l) - 1))] if l else 0.0
+
+        n = len(result.latencies)
+        res = (
+            f"{name} ops={n} errors={len(result.errors)} secs={result.secs:.3f}"
+            + f" rate={n / result.secs if result.secs else 0:.1f}/s"
+            + f" p50={_pct(0.5):.4f} p99={_pct(0.99):.4f}"
+            + f" docker_calls={sum(h.calls for h in self.hosts.values())}"
+        )
+        e = sorted(set(f"{type(x).__name__}: {x}" for x in result.errors))
+        if e:
+            res += "\n" + "\n".join(e[:5])
+        return res
+
+    def _tls_dir(self, root):
+        res = pkio.mkdir_parent(pkio.py_path(root).join("tls"))
+        for h in self.hosts:
+            for f in "cacert.pem", "cert.pem", "key.pem":
+                pkio.write_text(pkio.mkdir_parent(res.join(h)).join(f), "bench")
+        return res
+
+
+class _FakeHost:
+    """Emulates the docker.APIClient methods used by RSDockerSpawner
+
+    Calls sleep `latency` seconds and fail with a connection error
+    at `failure_rate`. Containers are in memory.
+    """
+
+    def __init__(self, bench, host):
+        self._bench = bench
+        self._containers = PKDict()
+        self._events = []
+        self._lock = threading.Lock()
+        self._seq = 0
+        self.calls = 0
+        self.removed = 0
+        self.gpus = [f"GPU-{host}-{i}" for i in range(bench.gpus_per_host)]
+        self.host = host
+
+    def container_add(self, name, port, running=True):
+        with self._lock:
+            return self._create(name, {"rsdockerspawner_port": str(port)}, running)
+
+    def containers(self, all=False, filters=None):
+        self._call()
+        with self._lock:
+            return [
+                PKDict(
+                    Id=c.Id,
+                    Labels=c.Labels,
+                    Names=[c.Name],
+                    State=c.State.Status,
+                    Status=PKDict(
+                        created="Created",
+                        exited="Exited (0)",
+                        running="Up",
+                    )[c.State.Status],
+                )
+                for c in self._containers.values()
+                if (all or c.State.Running) and self._matches(c, filters)
+            ]
+
+    def create_container(self, name=None, labels=None, host_config=None, **kwargs):
+        self._call()
+        with self._lock:
+            if self._find("/" + name, raise_404=False):
+                raise self._error(409, f"Conflict. The container name {name} is in use")
+            c = self._create(name, labels or {}, False)
+            c.HostConfig = host_config or PKDict()
+            return PKDict(Id=c.Id)
+
+    def create_host_config(self, **kwargs):
+        return PKDict(kwargs)
+
+    def events(self, decode=None, filters=None, **kwargs):
+        self._call(fail=False)
+        q = queue.Queue()
+        with self._lock:
+            self._events.append(q)
+
+        def _gen():
+            while True:
+                yield q.get()
+
+        return _gen()
+
+    def info(self):
+        self._call()
+        with self._lock:
+            return PKDict(
+                ContainersRunning=sum(
+                    1 for c in self._containers.values() if c.State.Running
+                ),
+                GenericResources=[
+                    PKDict(NamedResourceSpec=PKDict(Kind="NVIDIA-GPU", Value=g))
+                    for g in self.gpus
+                ],
+                MemTotal=64 << 30,
+                NCPU=32,
+            )
+
+    def inspect_container(self, container):
+        self._call()
+        with self._lock:
+            return self._find(container)
+
+    def inspect_image(self, image):
+        self._call()
+        return PKDict(
+            Config=PKDict(Cmd=["start-notebook"]),
+            Id="sha256:" + "0" * 64,
+            RepoDigests=[],
+        )
+
+    def ping(self):
+        self._call()
+        return True
+
+    def pull(self, repository, tag=None, **kwargs):
+        self._call()
+
+    def remove_container(self, container, **kwargs):
+        self._call()
+        with self._lock:
+            c = self._find(container)
+            del self._containers[c.Id]
+            self.removed += 1
+            self._event(c, "destroy")
+
+    def start(self, container, **kwargs):
+        self._call()
+        with self._lock:
+            c = self._find(container)
+            d = self._devices(c)
+            if d:
+                u = set()
+                for x in self._containers.values():
+                    if x.State.Running:
+                        u.update(self._devices(x))
+                if d & u or d - set(self.gpus):
+                    raise self._error(500, f"devices={sorted(d)} in use or unknown")
+            c.State.pkupdate(Running=True, Status="running")
+
+    def stats(self, container, **kwargs):
+        self._call()
+        return PKDict(
+            cpu_stats=PKDict(cpu_usage=PKDict(total_usage=0)),
+            memory_stats=PKDict(usage=1 << 30),
+        )
+
+    def stop(self, container, **kwargs):
+        self._call()
+        with self._lock:
+            c = self._find(container)
+            c.State.pkupdate(Running=False, Status="exited")
+            self._event(c, "die")
+
+    def wait(self, container, timeout=None, condition=None, **kwargs):
+        self._call()
+        t = time.monotonic() + (timeout or 60)
+        while time.monotonic() < t:
+            with self._lock:
+                self._find(container)
+            time.sleep(0.01)
+        raise requests.exceptions.ReadTimeout(f"fake wait timeout host={self.host}")
+
+    def running(self, prefix):
+        with self._lock:
+            return sum(
+                1
+                for c in self._containers.values()
+                if c.State.Running and c.Name.startswith("/" + prefix)
+            )
+
+    def _call(self, fail=True):
+        self.calls += 1
+        if self._bench.latency:
+            time.sleep(self._bench.latency)
+        if fail and random.random() < self._bench.failure_rate:
+            raise requests.exceptions.ConnectionError(f"fake failure host={self.host}")
+
+    def _create(self, name, labels, running):
+        self._seq += 1
+        res = PKDict(
+            Id=f"{self._seq:016x}{abs(hash(self.host)):048x}"[:64],
+            Labels=labels,
+            Name="/" + name,
+            State=PKDict(
+                Error="",
+                ExitCode=0,
+                FinishedAt="",
+                Running=running,
+                Status="running" if running else "created",
+            ),
+        )
+        self._containers[res.Id] = res
+        return res
+
+    def _devices(self, container):
+        res = set()
+        for r in container.get("HostConfig", PKDict()).get("DeviceRequests") or []:
+            if r.get("Count"):
+                # docker chooses, which is not exclusive
+                res.update(self.gpus[: max(r["Count"], 0) or len(self.gpus)])
+            res.update(r.get("DeviceIDs") or [])
+        return res
+
+    def _error(self, status, msg):
+        r = requests.Response()
+        r.status_code = status
+        if status == 404:
+            return docker.errors.NotFound(msg, response=r)
+        return docker.errors.APIError(msg, response=r)
+
+    def _event(self, container, action):
+        e = PKDict(
+            Action=action,
+            Actor=PKDict(
+                Attributes=PKDict(container.Labels, name=container.Name[1:]),
+                ID=container.Id,
+            ),
+            Type="container",
+        )
+        for q in self._events:
+            q.put(e)
+
+    def _find(self, container, raise_404=True):
+        for c in self._containers.values():
+            # Name has a leading slash, which is optional in requests
+            if container in (c.Id, c.Name, c.Name[1:]):
+                return c
+        if raise_404:
+            raise self._error(404, f"No such container: {container}")
+        return None
+
+    def _matches(self, container, filters):
+        if not filters:
+            return True
+        l = filters.get("label")
+        if l and l not in container.Labels:
+            return False
+        s = filters.get("status")
+        if s and (s == "running") != container.State.Running:
+            return False
+        return True
+
+
+class _User:
+    """Attributes of `jupyterhub.user.User` used by the spawner"""
+
+    def __init__(self, name, last_activity):
+        self.escaped_name = name
+        self.id = abs(hash(name))
+        self.last_activity = last_activity or datetime.datetime.now()
+        self.name = name
+        self.orm_user = None
+        self.server = None
+        self.settings = PKDict()
+        self.spawners = PKDict()
+        self.url = f"/user/{name}/"
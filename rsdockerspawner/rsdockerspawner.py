@@ -9,15 +9,25 @@ from pykern import pkconfig
 from pykern import pkio
 from pykern import pkjson, pkresource
 from pykern.pkcollections import PKDict
-from pykern.pkdebug import pkdp, pkdpretty, pkdexc
+from pykern.pkdebug import pkdpretty, pkdexc
 import asyncio
+import atexit
+import concurrent.futures
+import contextlib
 import copy
 import datetime
 import docker
 import glob
+import heapq
+import itertools
 import os
 import os.path
+import prometheus_client
+import prometheus_client.core
+import requests
+import signal
 import socket
+import threading
 import time
 import tornado
 import traitlets
@@ -26,12 +36,163 @@ import traitlets
 #: container label for jupyter port
 _PORT_LABEL = "rsdockerspawner_port"
 
+#: Seconds for each phase of `RSDockerSpawner.start` (exported via JupyterHub's /metrics)
+_METRIC_SPAWN_PHASE = prometheus_client.Histogram(
+    "rsdockerspawner_spawn_phase_seconds",
+    "Seconds spent in each phase of a spawn",
+    ["phase", "pool", "host"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+#: Slots taken from inactive users by `__pool_gc` when allocating (alloc) or by `__reap_loop` (reap)
+_METRIC_POOL_GC_EVICTIONS = prometheus_client.Counter(
+    "rsdockerspawner_pool_gc_evictions_total",
+    "Slots taken from the least active user when a pool is full or by the reaper",
+    ["pool", "host", "reason"],
+)
+
+#: Seconds waiting for pool.lock
+_METRIC_POOL_LOCK_WAIT = prometheus_client.Histogram(
+    "rsdockerspawner_pool_lock_wait_seconds",
+    "Seconds waiting to acquire a pool's allocation lock",
+    ["pool"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+
+#: 1 if the host is admitted for allocation, 0 if its circuit is open
+_METRIC_HOST_HEALTHY = prometheus_client.Gauge(
+    "rsdockerspawner_host_healthy",
+    "Host is healthy (1) or excluded from allocation (0)",
+    ["host"],
+)
+
+#: Transitions of a host's circuit
+_METRIC_HOST_HEALTH_TRANSITIONS = prometheus_client.Counter(
+    "rsdockerspawner_host_health_transitions_total",
+    "Hosts becoming healthy (re-admitted) or unhealthy (excluded)",
+    ["host", "state"],
+)
+
+#: Seconds a docker call waits for one of its host's threads
+_METRIC_DOCKER_QUEUE_WAIT = prometheus_client.Histogram(
+    "rsdockerspawner_docker_queue_wait_seconds",
+    "Seconds a docker call waits for a thread of its host's executor",
+    ["host"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+
+#: Seconds in a docker call (after the queue wait)
+_METRIC_DOCKER_CALL = prometheus_client.Histogram(
+    "rsdockerspawner_docker_call_seconds",
+    "Seconds a docker call takes by host and method",
+    ["host", "method"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+#: Docker calls rejected, because their host's queue was full
+_METRIC_DOCKER_REJECTED = prometheus_client.Counter(
+    "rsdockerspawner_docker_rejected_total",
+    "Docker calls rejected, because docker_host_queue_max calls were queued",
+    ["host"],
+)
+
+#: Drift found by `__audit` (kind is orphan or vanished)
+_METRIC_AUDIT_DRIFT = prometheus_client.Counter(
+    "rsdockerspawner_audit_drift_total",
+    "Containers without slots (orphan) and slots whose containers are gone (vanished)",
+    ["host", "kind"],
+)
+
+#: Suffixes of mem_per_slot (e.g. "8G")
+_BYTE_UNITS = PKDict(K=1 << 10, M=1 << 20, G=1 << 30, T=1 << 40)
+
 #: CPU Fair Scheduler (CFS) period (see below)
 _CPU_PERIOD_US = 100000
 
+#: Docker events which mean a container no longer occupies its slot
+_EVENTS_GONE = ("destroy", "die", "stop")
+
+#: Initial seconds to wait before reconnecting a host's event stream
+_EVENTS_RETRY_MIN_SECS = 1.0
+
+#: Maximum seconds to wait before reconnecting a host's event stream
+_EVENTS_RETRY_MAX_SECS = 60.0
+
+#: Default seconds between checks of the cfg file's mtime and retired slots (see `__reload_loop`)
+_RELOAD_SECS = 5.0
+
+#: Default seconds between audits of containers against slots (see `__audit_loop`)
+_AUDIT_SECS = 300.0
+
+#: Container states which are not drift when assigned to a slot
+_AUDIT_LIVE_STATES = ("created", "running")
+
+#: Default seconds between runs of the reaper (see reap_free_slots)
+_REAP_SECS = 60.0
+
+#: Default maximum evictions per pool in each run of the reaper
+_REAP_MAX_EVICTIONS = 2
+
+#: Default seconds `start` waits for an existing container to be removed
+_REMOVE_WAIT_SECS = 10.0
+
+#: Default seconds between host health probes
+_HOST_HEALTH_SECS = 10.0
+
+#: Default seconds before a health probe fails
+_HOST_HEALTH_TIMEOUT_SECS = 5.0
+
+#: Default consecutive failures which exclude a host from allocation
+_HOST_HEALTH_FAILURES = 3
+
+#: Default seconds between refreshes of host load (see placement)
+_HOST_LOAD_SECS = 30.0
+
+#: Seconds a spawn failure counts against a host's load
+_HOST_LOAD_FAILURE_SECS = 600.0
+
+#: Pool placement policies: first free slot in __pools_reconcile order or least loaded host
+_PLACEMENTS = ("load", "ports")
+
+#: Kind of docker info GenericResources which are GPUs contains this (see `__host_gpus_init`)
+_GPU_RESOURCE_KIND = "GPU"
+
+#: Default number of concurrent pulls by the image prefetcher
+_IMAGE_PREFETCH_CONCURRENCY = 4
+
+#: Default seconds a host's resolved address is used before refreshing
+_HOST_ADDR_TTL_SECS = 300.0
+
+#: Seconds before retrying a failed refresh of a host's address
+_HOST_ADDR_RETRY_SECS = 10.0
+
+#: Default seconds to reconcile a host's containers at startup
+_INIT_HOST_TIMEOUT_SECS = 30.0
+
+#: Default size of the keep-alive connection pool of each host's client
+_DOCKER_MAX_POOL_SIZE = 10
+
+#: Default concurrent docker calls per host (threads in its executor)
+_DOCKER_HOST_CONCURRENCY = 8
+
+#: Default docker calls per host (running and waiting) before calls are rejected
+_DOCKER_HOST_QUEUE_MAX = 100
+
+#: Files in tls_dir/<host> which identify a host's client
+_TLS_FILES = ("cacert.pem", "cert.pem", "key.pem")
+
 #: dump the slots whenever an update happens
 _POOLS_DUMP_FILE = "rsdockerspawner_pools.json"
 
+#: Default seconds updates are coalesced before writing _POOLS_DUMP_FILE
+_POOLS_DUMP_SECS = 1.0
+
+#: Pool attributes which are not written to _POOLS_DUMP_FILE
+_POOL_NO_DUMP = frozenset(("active_slots", "free_slots", "lock", "reserved", "retired"))
+
+#: Pool attributes which are not from cfg
+_POOL_RUNTIME = _POOL_NO_DUMP.union(("slots",))
+
 #: Default user when no specific volume for user ['*']
 _DEFAULT_USER_GROUP = "everybody"
 
@@ -47,6 +208,9 @@ _MIN_MIN_ACTIVITY_SECS = 5.0 if pkconfig.channel_in_internal_test() else 300.0
 #: Minimum number of processes available to the user not running in Jupyter
 _MIN_NPROC_AVAIL = 512
 
+#: Verify internal indexes after every update (expensive)
+_CHECK_INDEXES = pkconfig.channel_in_internal_test()
+
 #: User that won't match a legimate user
 _DEFAULT_USER = "*"
 
@@ -73,15 +237,101 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
 
     __pools = PKDict()
 
+    #: cname to (pool, slot) for every assigned slot
+    __cname_to_slot = PKDict()
+
+    #: user to pool name for users in user_groups (see `__init_pools`)
+    __users_to_pool = PKDict()
+
+    #: user to volumes memoized by `volume_binds` (see `__init_volumes`)
+    __users_to_binds = PKDict()
+
+    #: bind directories known to exist (see `_volumes_to_binds`)
+    __binds_created = set()
+
+    #: host to resolved addr, expires, and refresh task (see `__host_addr`)
+    __host_addrs = PKDict()
+
+    #: host to listing of containers shared by polls (see `__containers_cached`)
+    __containers_cache = PKDict()
+
+    #: host to thread which subscribes to the host's events
+    __events_threads = PKDict()
+
+    #: hosts whose event stream is connected and synchronized
+    __events_live = set()
+
+    #: container id to future set by its "destroy" event (see `__remove_wait`)
+    __remove_waiters = PKDict()
+
+    #: host to drift found by the previous audit (see `__audit_host`)
+    __audit_drift = PKDict()
+
+    #: host to circuit state (see `__host_health_probe`)
+    __host_health = PKDict()
+
+    #: host to cpus by NUMA node (see `__host_cpus_init`)
+    __host_cpus = PKDict()
+
+    #: host to GPU device ids and those assigned to slots (see `__host_gpus_init`)
+    __host_gpus = PKDict()
+
+    #: host to NCPU and MemTotal from docker info (see `__host_resources_init`)
+    __host_resources = PKDict()
+
+    #: host to load metrics (see `__host_load_refresh`)
+    __host_load = PKDict()
+
+    #: host to number of assigned slots, which is current unlike __host_load
+    __host_assigned = PKDict()
+
+    #: host to image to id and cmd of images known to be on the host
+    __host_images = PKDict()
+
+    #: image to id most recently pulled by the prefetcher
+    __image_current = PKDict()
+
+    #: images used by spawners (see `pull_image`)
+    __images = set()
+
+    #: tie breaker so heap entries never compare slots
+    __heap_seq = itertools.count()
+
     __cfg = PKDict()
 
-    __client = None
+    #: value of the cfg trait (JSON or a file name) read by `__cfg_load`
+    __cfg_source = None
+
+    #: value of the volumes trait (see `__fixup_cfg`)
+    __cfg_volumes = None
+
+    #: names of background tasks which are running (see `__loops_start`)
+    __loops = set()
+
+    #: serializes `__reload`
+    __reload_lock = asyncio.Lock()
+
+    #: host to the events stream being read by its thread (see `__host_remove`)
+    __events_streams = PKDict()
+
+    #: docker.APIClient (and its tls_signature) per host shared by all instances
+    __docker_clients = PKDict()
+
+    #: __docker_clients is accessed from executor threads (see `__host_submit`)
+    __docker_clients_lock = threading.Lock()
+
+    #: host to executor and queued calls (see `__host_submit`)
+    __host_executors = PKDict()
+
+    #: pools have changed since _POOLS_DUMP_FILE was written
+    __pools_dump_dirty = False
+
+    #: writes _POOLS_DUMP_FILE (see `__pools_dump`)
+    __pools_dump_task = None
 
     @property
     def client(self):
-        if self.__client is None:
-            self.__client = self.__docker_client(self.__slot.host)
-        return self.__client
+        return self.__docker_client(self.__slot.host)
 
     async def create_object(self, *args, **kwargs):
         await self.__slot_alloc()
@@ -94,22 +344,30 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
             y = getattr(self, x)
             if y is not None:
                 self.extra_host_config[x] = y
+        if self.__cpuset:
+            self.extra_host_config.update(self.__cpuset)
         res = await super().create_object(*args, **kwargs)
+        self.__slot.cid = res[self.object_id_key]
         return res
 
     def docker(self, method, *args, **kwargs):
+        """Call method in the executor of the slot's host (see `__host_submit`)"""
         if method == "create_container" and self.__gpus:
             # See https://github.com/sigurdkb/docker-py/blob/f5e11cdc6e3bd179312aceededf323cbb7cdc448/docker/types/containers.py#L529
+            # Count and DeviceIDs are exclusive; docker chooses if no inventory
+            d = self.__slot.gpus
             kwargs["host_config"]["DeviceRequests"] = [
                 {
                     "Driver": "",
-                    "Count": self.__gpus,
-                    "DeviceIDs": None,
+                    "Count": 0 if d else self.__gpus,
+                    "DeviceIDs": list(d) if d else None,
                     "Capabilities": [["gpu"]],
                     "Options": {},
                 }
             ]
-        return super().docker(method, *args, **kwargs)
+        return asyncio.ensure_future(
+            self.__host_call(self.__slot.host, method, *args, **kwargs),
+        )
 
     def get_env(self, *args, **kwargs):
         res = super().get_env(*args, **kwargs)
@@ -117,7 +375,7 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
         return res
 
     async def get_ip_and_port(self):
-        return (socket.gethostbyname(self.__slot.host), self.__slot.port)
+        return (await self.__host_addr(self.__slot.host, self.log), self.__slot.port)
 
     async def get_object(self, *args, **kwargs):
         if not (await self.__slot_alloc(no_raise=True)):
@@ -125,16 +383,66 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
         res = await super().get_object(*args, **kwargs)
         if not res:
             self.__slot_free()
+        elif res["State"]["Running"] and self.__slot.cname == self.__cname():
+            self.__slot.cid = res[self.object_id_key]
         return res
 
-    async def pull_image(self, *args, **kwargs):
+    async def poll(self):
+        if not self.__class_is_initialized:
+            await self.__init_class()
+        s = self.__slot
+        if s and s.cid and s.cname == self.__cname() and s.host in self.__events_live:
+            # Running, because the event stream unassigns stopped containers
+            await self.__slot_alloc(no_raise=True)
+            return None
+        if not self.__cfg.poll_cache_secs:
+            return await super().poll()
+        if not (await self.__slot_alloc(no_raise=True)):
+            return 0
+        try:
+            c = (await self.__containers_cached(self.__slot.host)).get(self.__cname())
+        except Exception as e:
+            self.log.warning(
+                "poll: containers failed host=%s error=%s",
+                self.__slot.host,
+                e,
+            )
+            c = None
+        if c and c["State"] == "running":
+            return None
+        # Not running or created after the listing so inspect to be sure
+        return await super().poll()
+
+    async def get_command(self):
+        if not self.cmd:
+            i = self.__host_images.get(self.__slot.host, PKDict()).get(self.image)
+            if i:
+                # avoids inspect_image
+                return i.cmd + self.get_args()
+        return await super().get_command()
+
+    async def pull_image(self, image):
 
         # RJN need to fix this
         # [I 2025-12-18 17:06:24.356 JupyterHub log:192] 200 POST /hub/api/users/vagrant/activity (vagrant@127.0.0.1) 22.00ms
         # [D 2025-12-18 17:06:25.148 JupyterHub rsdockerspawner:557] slot_alloc: already allocated slot=1 cname=/jupyter-vagrant inactivity_secs=514
 
         await self.__slot_alloc()
-        await super().pull_image(*args, **kwargs)
+        self.__images.add(image)
+        h = self.__slot.host
+        p = self.pull_policy.lower()
+        x = self.__host_image_is_current(h, image)
+        if x or (x is None and p != "always"):
+            self.log.debug("pull_image: image=%s on host=%s", image, h)
+            return
+        if (
+            p == "ifnotpresent"
+            and image not in self.__host_images.get(h, PKDict())
+            and await self.__host_image(h, image, self.log)
+        ):
+            # recorded so later spawns on h skip inspect_image
+            return
+        await super().pull_image(image)
 
     @property
     def read_only_volumes(self):
@@ -161,8 +469,11 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
         binds = super()._volumes_to_binds(*args, **kwargs)
         # POSIT: user running jupyterhub is also the jupyter user
         for v in binds:
+            if v in self.__binds_created:
+                continue
             if not os.path.exists(v):
                 os.makedirs(v)
+            self.__binds_created.add(v)
         return binds
 
     @property
@@ -175,32 +486,392 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
         Returns:
             dict: DockerSpawner volume map
         """
-        res = PKDict()
-        for n in self.user.name, _DEFAULT_USER:
-            if n not in self.__users_to_volumes:
-                continue
-            for s, v in self.__users_to_volumes[n].items():
-                if s not in res:
-                    res[s] = copy.deepcopy(v)
+        res = self.__users_to_binds.get(self.user.name)
+        if res is None:
+            res = PKDict()
+            for n in self.user.name, _DEFAULT_USER:
+                if n not in self.__users_to_volumes:
+                    continue
+                for s, v in self.__users_to_volumes[n].items():
+                    if s not in res:
+                        # not copied, because _volumes_to_binds does not modify
+                        res[s] = v
+            self.__users_to_binds[self.user.name] = res
         self.log.debug("user=%s volumes=%s", self.user.name, res)
         return self._volumes_to_binds(res, {})
 
+    @classmethod
+    async def __audit(cls, log):
+        """List containers on healthy hosts concurrently and fix drift
+
+        See `__audit_host`.
+
+        Args:
+            log (logging.Logger): logger
+        """
+        h = sorted(
+            set(
+                s.host
+                for p in cls.__pools.values()
+                for s in p.slots
+                if cls.__host_is_healthy(s.host)
+            ),
+        )
+        t = time.time()
+        r = await asyncio.gather(
+            *(
+                cls.__host_call(
+                    x, "containers", all=True, filters={"label": _PORT_LABEL}
+                )
+                for x in h
+            ),
+            return_exceptions=True,
+        )
+        n = 0
+        for x, c in zip(h, r):
+            if isinstance(c, Exception):
+                log.error("audit: containers failed host=%s error=%s", x, c)
+                cls.__audit_drift.pkdel(x)
+                continue
+            n += await cls.__audit_host(x, c, log)
+        log.info(
+            "audit: hosts=%d fixed=%d secs=%.3f",
+            len(h),
+            n,
+            time.time() - t,
+        )
+
+    @classmethod
+    async def __audit_host(cls, host, containers, log):
+        """Remove orphaned containers and unassign vanished slots
+
+        Spawns and removals are in flight while containers are
+        listed so drift is only fixed when the previous audit found
+        the same container or slot and container id.
+
+        Args:
+            host (str): docker host
+            containers (list): labeled containers on host
+            log (logging.Logger): logger
+        Returns:
+            int: number of containers removed and slots unassigned
+        """
+
+        async def _remove(container):
+            log.info(
+                "audit: removing orphan cname=%s cid=%s host=%s port=%s state=%s",
+                container["Names"][0],
+                container["Id"],
+                host,
+                container["Labels"].get(_PORT_LABEL),
+                container["State"],
+            )
+            try:
+                await cls.__host_call(
+                    host,
+                    "remove_container",
+                    container["Id"],
+                    force=True,
+                )
+            except docker.errors.NotFound:
+                pass
+            except Exception as e:
+                log.error(
+                    "audit: remove cid=%s host=%s failed: %s",
+                    container["Id"],
+                    host,
+                    e,
+                )
+
+        d = audit_host(
+            host,
+            (s for p in cls.__pools.values() for s in p.slots),
+            containers,
+        )
+        o = set(c["Id"] for c in d.orphans)
+        v = set((s.num, s.cid) for s in d.vanished)
+        x = cls.__audit_drift.get(host, PKDict(orphans=set(), vanished=set()))
+        cls.__audit_drift[host] = PKDict(orphans=o, vanished=v)
+        o = [c for c in d.orphans if c["Id"] in x.orphans]
+        v = [s for s in d.vanished if (s.num, s.cid) in x.vanished]
+        for s in v:
+            _METRIC_AUDIT_DRIFT.labels(host=host, kind="vanished").inc()
+            # unassigns only if the slot still has the same container
+            cls.__events_gone(host, s.cid, s.cname, "audit", log)
+        if o:
+            _METRIC_AUDIT_DRIFT.labels(host=host, kind="orphan").inc(len(o))
+            await asyncio.gather(*(_remove(c) for c in o))
+        return len(o) + len(v)
+
+    @classmethod
+    async def __audit_loop(cls, log):
+        """Reconcile containers with slots every audit_secs (see `__audit`)"""
+        while True:
+            await asyncio.sleep(cls.__cfg.audit_secs)
+            try:
+                await cls.__audit(log)
+            except Exception as e:
+                log.error("audit: failed error=%s stack=%s", e, pkdexc())
+
     @classmethod
     def __docker_client(cls, host):
-        k = {
-            "version": "auto",
-            "base_url": "tcp://{}:2376".format(host),
-        }
+        """Client for host which is cached until certs change or host fails
+
+        Creating a client loads certs, does a TLS handshake, and
+        negotiates the version so clients are shared by all users of
+        the host. requests keeps connections alive (up to
+        docker_max_pool_size per host).
+
+        Args:
+            host (str): docker host
+        Returns:
+            docker.APIClient: shared client
+        """
         d = cls.__cfg.tls_dir.join(host)
         assert d.check(dir=True), f"tls_dir/<host> does not exist: {d}"
-        k["tls"] = docker.tls.TLSConfig(
-            client_cert=(str(d.join("cert.pem")), str(d.join("key.pem"))),
-            ca_cert=str(d.join("cacert.pem")),
-            verify=True,
-        )
-        pkdp(k["tls"].ca_cert)
         assert d.join("key.pem").exists(), "{}does not exist".format(d.join("key.pem"))
-        return docker.APIClient(**k)
+        t = tuple(
+            (s.st_ino, s.st_mtime_ns, s.st_size)
+            for s in (os.stat(str(d.join(f))) for f in _TLS_FILES)
+        )
+        with cls.__docker_clients_lock:
+            c = cls.__docker_clients.get(host)
+            if c and c.tls_signature == t:
+                return c.client
+        # Outside the lock, because "auto" talks to the host
+        c = PKDict(
+            client=docker_client(
+                host,
+                cls.__cfg.tls_dir,
+                max_pool_size=cls.__cfg.docker_max_pool_size,
+            ),
+            tls_signature=t,
+        )
+        with cls.__docker_clients_lock:
+            cls.__docker_clients[host] = c
+        return c.client
+
+    @classmethod
+    def __docker_client_check(cls, host, exc):
+        """Evict host's client if exc indicates the host (not the request) failed
+
+        Args:
+            host (str): docker host
+            exc (Exception): result of call (may be None)
+        """
+        if not cls.__host_failed(exc):
+            return
+        with cls.__docker_clients_lock:
+            cls.__docker_clients.pkdel(host)
+
+    @classmethod
+    async def __containers_cached(cls, host):
+        """Containers on host listed at most poll_cache_secs ago
+
+        Concurrent callers share one listing.
+
+        Args:
+            host (str): docker host
+        Returns:
+            PKDict: cname to container (from `docker.APIClient.containers`)
+        """
+        c = cls.__containers_cache.get(host)
+        if c is None:
+            c = cls.__containers_cache[host] = PKDict(
+                containers=None,
+                expires=0,
+                task=None,
+            )
+        if c.expires > time.time():
+            return c.containers
+        if not c.task:
+            c.task = asyncio.create_task(cls.__containers_list(host, c))
+        return await asyncio.shield(c.task)
+
+    @classmethod
+    async def __containers_list(cls, host, cache):
+        t = time.time()
+        try:
+            x = await cls.__host_call(
+                host,
+                "containers",
+                all=True,
+                filters={"label": _PORT_LABEL},
+            )
+        finally:
+            cache.task = None
+        cache.pkupdate(
+            containers=PKDict((c["Names"][0], c) for c in x),
+            expires=t + cls.__cfg.poll_cache_secs,
+        )
+        return cache.containers
+
+    @classmethod
+    def __events_gone(cls, host, cid, cname, action, log):
+        """Unassign the slot of a container which died or was removed
+
+        The cid must match, because the slot may have been reassigned
+        (e.g. `start` removes the old container) before the event
+        arrived.
+        """
+        if action == "destroy":
+            f = cls.__remove_waiters.pkdel(cid)
+            if f and not f.done():
+                f.set_result(None)
+        p, s = cls.__slot_for_container(cname)
+        if not s or s.host != host or s.cid != cid:
+            return
+        log.info(
+            "events: %s slot=%s cname=%s pool=%s host=%s",
+            action,
+            s.num,
+            cname,
+            p.name,
+            host,
+        )
+        cls.__slot_unassign(s)
+        cls.__pools_dump(log)
+
+    @classmethod
+    def __events_live_set(cls, host, is_live):
+        if is_live:
+            cls.__events_live.add(host)
+        else:
+            cls.__events_live.discard(host)
+
+    @classmethod
+    def __events_resync(cls, host, containers, log):
+        """Unassign slots on host whose containers exited or disappeared
+
+        Called after (re)connecting the event stream, which may have
+        missed events. Slots without a cid are being spawned and
+        "created" containers are about to be started.
+        """
+        x = PKDict((c["Id"], c["State"]) for c in containers)
+        for p in cls.__pools.values():
+            for s in p.slots:
+                if (
+                    s.host != host
+                    or not s.cid
+                    or x.get(s.cid) in ("created", "running")
+                ):
+                    continue
+                cls.__events_gone(host, s.cid, s.cname, "resync", log)
+        cls.__events_live_set(host, True)
+
+    @classmethod
+    def __events_start(cls, log):
+        l = asyncio.get_running_loop()
+        for h in sorted(set(h for p in cls.__pools.values() for h in p.hosts)):
+            if h in cls.__events_threads:
+                continue
+            t = threading.Thread(
+                target=cls.__events_thread,
+                args=(h, l, log),
+                daemon=True,
+                name=f"rsdockerspawner-events-{h}",
+            )
+            cls.__events_threads[h] = t
+            t.start()
+
+    @classmethod
+    def __events_thread(cls, host, loop, log):
+        """Follow host's container events until the hub exits
+
+        The stream is opened before listing containers so no events
+        are missed between the resync and the stream. Reconnects
+        with exponential backoff. Exits when the host is removed
+        (see `__host_remove`).
+        """
+        r = _EVENTS_RETRY_MIN_SECS
+        t = threading.current_thread()
+        while cls.__events_threads.get(host) is t:
+            try:
+                c = cls.__docker_client(host)
+                e = c.events(
+                    decode=True,
+                    filters={
+                        "event": list(_EVENTS_GONE),
+                        "label": _PORT_LABEL,
+                        "type": "container",
+                    },
+                )
+                cls.__events_streams[host] = e
+                x = c.containers(all=True, filters={"label": _PORT_LABEL})
+                loop.call_soon_threadsafe(cls.__events_resync, host, x, log)
+                r = _EVENTS_RETRY_MIN_SECS
+                for v in e:
+                    a = v.get("Actor", PKDict())
+                    loop.call_soon_threadsafe(
+                        cls.__events_gone,
+                        host,
+                        a.get("ID") or v.get("id"),
+                        "/" + a.get("Attributes", PKDict()).get("name", ""),
+                        v.get("Action") or v.get("status"),
+                        log,
+                    )
+                log.warning("events: stream closed host=%s", host)
+            except Exception as e:
+                cls.__docker_client_check(host, e)
+                log.warning(
+                    "events: stream error host=%s error=%s retry_secs=%s",
+                    host,
+                    e,
+                    r,
+                )
+            loop.call_soon_threadsafe(cls.__events_live_set, host, False)
+            time.sleep(r)
+            r = min(r * 2, _EVENTS_RETRY_MAX_SECS)
+
+    @classmethod
+    def __metrics_slots(cls):
+        """Free and used slots per pool and host and GPUs per host (see `_Collector`)"""
+        res = prometheus_client.core.GaugeMetricFamily(
+            "rsdockerspawner_slots",
+            "Slots by pool, host, and state (free or used)",
+            labels=["pool", "host", "state"],
+        )
+        g = prometheus_client.core.GaugeMetricFamily(
+            "rsdockerspawner_gpus",
+            "GPU devices by host and state (free or used)",
+            labels=["host", "state"],
+        )
+        for h, v in cls.__host_gpus.items():
+            u = sum(1 for d in v.devices if d in v.used)
+            g.add_metric([h, "free"], len(v.devices) - u)
+            g.add_metric([h, "used"], u)
+        for p in cls.__pools.values():
+            x = PKDict()
+            for s in p.slots:
+                x.pksetdefault1(s.host, lambda: PKDict(free=0, used=0))[
+                    "used" if s.cname else "free"
+                ] += 1
+            for h, v in x.items():
+                for k in sorted(v):
+                    res.add_metric([p.name, h, k], v[k])
+        return [res, g]
+
+    @contextlib.contextmanager
+    def __metrics_phase(self, phase):
+        """Observe seconds in phase labeled by pool and host
+
+        Labels are from the slot at the end of the phase or the
+        start if there is no slot then (e.g. remove_object).
+        """
+
+        def _labels():
+            p, s = self.__slot_for_container(self.__cname())
+            return p and PKDict(pool=p.name, host=s.host)
+
+        l = _labels()
+        t = time.monotonic()
+        try:
+            yield
+        finally:
+            _METRIC_SPAWN_PHASE.labels(
+                phase=phase,
+                **(_labels() or l or PKDict(pool="", host="")),
+            ).observe(time.monotonic() - t)
 
     def __cname(self):
         return "/" + self.object_name
@@ -230,135 +901,1268 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
         cfg.user_groups = u
         return cfg
 
-    async def __init_class(self):
-        cls = self.__class__
-        async with cls.__class_lock:
-            if cls.__class_is_initialized:
-                return
-            # easiest way to access config generated by rsconf shared by instances
-            cls.__cfg.update(cls.__fixup_cfg(pkjson.load_any(self.cfg), self.volumes))
-            assert cls.__cfg.pools, "No pools in cfg"
-            d = pkio.py_path(cls.__cfg.tls_dir)
-            assert d.check(dir=True), "tls_dir={} does not exist".format(d)
-            cls.__cfg.tls_dir = d
-            cls.__init_volumes(self.log)
-            await cls.__init_pools(self.log)
-            cls.__class_is_initialized.add(True)
+    @classmethod
+    async def __host_addr(cls, host, log):
+        """Resolve host without blocking the event loop
+
+        Addresses are cached for host_addr_ttl_secs. An expired
+        address is returned while it is refreshed in the background
+        so routing continues when the resolver is slow or fails.
+
+        Args:
+            host (str): docker host
+            log (logging.Logger): logger
+        Returns:
+            str: IPv4 address
+        """
+        a = cls.__host_addrs.get(host)
+        if a is None:
+            return await cls.__host_addr_resolve(host, log)
+        if a.expires < time.time() and not a.task:
+            a.task = asyncio.create_task(cls.__host_addr_resolve(host, log))
+        return a.addr
+
+    @classmethod
+    async def __host_addr_resolve(cls, host, log):
+        a = cls.__host_addrs.get(host)
+        try:
+            i = await asyncio.get_running_loop().getaddrinfo(
+                host,
+                None,
+                family=socket.AF_INET,
+                type=socket.SOCK_STREAM,
+            )
+        except Exception as e:
+            if not a:
+                raise
+            log.warning(
+                "host_addr: resolve failed host=%s error=%s using addr=%s",
+                host,
+                e,
+                a.addr,
+            )
+            a.pkupdate(expires=time.time() + _HOST_ADDR_RETRY_SECS, task=None)
+            return a.addr
+        cls.__host_addrs[host] = PKDict(
+            addr=i[0][4][0],
+            expires=time.time() + cls.__cfg.host_addr_ttl_secs,
+            task=None,
+        )
+        return i[0][4][0]
+
+    @classmethod
+    async def __host_admit(cls, host, log):
+        """Reconcile host's slots with its containers and re-admit it
+
+        Only one runs per host (see `__host_health_probe`). Hosts which
+        were never initialized (init) are reconciled by `__init_host`
+        with the dump from startup, if any. Otherwise, see
+        `__host_readmit`.
+
+        Args:
+            host (str): docker host
+            log (logging.Logger): logger
+        """
+        h = cls.__host_health[host]
+        p = [x for x in cls.__pools.values() if any(s.host == host for s in x.slots)]
+        if h.init:
+            r = await cls.__init_host(host, p, log, h.slots_from_dump)
+        else:
+            r = await cls.__host_readmit(host, p, log)
+        if r and cls.__host_health.get(host) is h:
+            cls.__host_health_set(host, True, None, log)
+            for x in p:
+                # free slots of unhealthy hosts are not in free_slots
+                cls.__pool_index(x)
+            cls.__pools_dump(log)
 
     @classmethod
-    async def __init_containers(cls, pool, log, slots_from_dump):
-        c = None
-        hosts_copy = pool.hosts[:]
-        for h in hosts_copy:
+    async def __host_devices_init(cls, host, log):
+        """Initialize host's cpus and GPUs (errors are logged)"""
+        for k, f in ("cpus", cls.__host_cpus_init), ("gpus", cls.__host_gpus_init):
             try:
-                d = cls.__docker_client(h)
-            except docker.errors.DockerException as e:
-                log.error(
-                    "Docker error on pool=%s host=%s stack=%s ", pool.name, h, pkdexc()
-                )
-                pool.hosts.remove(h)
-                for s in list(pool.slots):
-                    if s.host == h:
-                        pool.slots.remove(s)
-                continue
-            for c in d.containers(all=True):
-                if _PORT_LABEL not in c["Labels"]:
-                    # not ours
-                    continue
-                p = int(c["Labels"][_PORT_LABEL])
-                n = c["Names"][0]
-                i = c["Id"]
-                s = cls.__init_slot_find(pool, h, p)
-                log.info(
-                    "init_containers: found slot=%s for cname=%s cid=%s host=%s port=%s",
-                    s and s.num,
-                    n,
-                    i,
-                    h,
-                    p,
-                )
-                if s and c["State"] == "running":
-                    if s.cname:
-                        # Duplicate containers with the same _PORT_LABEL
-                        log.error(
-                            "init_containers: duplicate assigned cname=%s in slot=%s (trying to assign cname=%s)",
-                            s.num,
-                            s.cname,
-                            n,
-                        )
-                    else:
-                        s2 = cls.__slot_for_container(n)[1]
-                        if s2:
-                            # n exists in another pool?
-                            log.error(
-                                "init_containers: another slot=%s for cname=%s so removing slot=%s host=%s",
-                                s2.num,
-                                n,
-                                s.num,
-                                s.host,
-                            )
-                        else:
-                            log.info(
-                                "init_containers: assigning cname=%s to slot=%s host=%s",
-                                n,
-                                s.num,
-                                s.host,
-                            )
-                            cls.__slot_assign(
-                                s,
-                                n,
-                                previous_slot=slots_from_dump.get(n),
-                            )
-                            continue
-                log.info(
-                    "init_containers: removing unallocated cname=%s cid=%s host=%s",
-                    n,
-                    i,
-                    h,
-                )
-                try:
-                    m = getattr(d, "remove_container")
-                    await self.executor.submit(m, i, force=True)
-                except Exception as e:
-                    log.error("init_containers: remove cid=%s failed: %s", i, e)
+                await f(host, log)
+            except Exception as e:
+                log.error("host_devices: %s host=%s error=%s", k, host, e)
 
     @classmethod
-    def __init_cpu_quota(cls, pool):
-        if pool.cpu_limit is None:
-            pool.pkupdate(cpu_quota=None, cpu_period=None)
-            return
-        # The unreleased docker.py has "nano_cpus", which is --cpus * 1e9.
-        # Which gets converted to cpu_period and cpu_quota in Docker source:
-        # https://github.com/moby/moby/blob/ec87479/daemon/daemon_unix.go#L142
-        # Also read this:
-        # https://www.kernel.org/doc/Documentation/scheduler/sched-bwc.txt
-        # You can see the values with:
-        # id=$(docker inspect --format='{{.Id}}' jupyter-vagrant)
-        # fs=/sys/fs/cgroup/cpu/docker/$id
-        # cat $fs/cpu.cfs_period_us
-        # cat $fs/cpu.cfs_quota_us
-        pool.pkupdate(
-            cpu_period=_CPU_PERIOD_US,
-            cpu_quota=int(float(_CPU_PERIOD_US) * pool.cpu_limit),
+    def __host_failed(cls, exc):
+        """Does exc indicate the host (not the request) failed
+
+        APIError means the daemon responded so the connection is fine.
+
+        Args:
+            exc (Exception): result of call (may be None)
+        Returns:
+            bool: host failed
+        """
+        return not isinstance(exc, docker.errors.APIError) and isinstance(
+            exc,
+            (docker.errors.DockerException, requests.exceptions.RequestException),
         )
 
     @classmethod
-    def __init_pids_limit(cls, pool):
-        if "pids_limit" in pool:
-            return
-        import resource
+    async def __host_cpus_init(cls, host, log):
+        """Set host's cpus by NUMA node from cpu_topology or discover them
 
-        if not pool.get("servers_per_host", 0):
-            pool.pids_limit = None
-            return
+        cpu_topology is host to a list of NUMA nodes (index is the node
+        id), each a list of cpu ids. Discovery is only done if a pool
+        on host has cpu_pinning. Docker info only has NCPU so
+        discovered cpus are one node and memory nodes are not pinned.
+
+        Args:
+            host (str): docker host
+            log (logging.Logger): logger
+        """
+        t = cls.__cfg.cpu_topology.get(host)
+        m = True
+        if t is None and any(
+            p.cpu_pinning and host in p.hosts for p in cls.__pools.values()
+        ):
+            t = [list(range((await cls.__host_call(host, "info"))["NCPU"]))]
+            m = False
+        if not t:
+            cls.__host_cpus.pkdel(host)
+            return
+        cls.__host_cpus[host] = PKDict(
+            cpus=[(int(c), n) for n, x in enumerate(t) for c in x],
+            numa=m,
+        )
+        log.info(
+            "host_cpus: host=%s cpus=%d nodes=%s",
+            host,
+            len(cls.__host_cpus[host].cpus),
+            len(t) if m else "unknown",
+        )
+
+    @classmethod
+    async def __host_gpus_init(cls, host, log):
+        """Set host's GPU devices from gpu_devices or discover them
+
+        Discovered devices are the NamedResourceSpecs in docker info
+        GenericResources (node-generic-resources in daemon.json)
+        whose Kind contains _GPU_RESOURCE_KIND. Discovery is only done
+        if a pool on host has gpus. Devices assigned to slots on host
+        are marked used.
+
+        Args:
+            host (str): docker host
+            log (logging.Logger): logger
+        """
+        d = cls.__cfg.gpu_devices.get(host)
+        if d is None and any(
+            cls.__pool_gpus(p) > 0 and host in p.hosts for p in cls.__pools.values()
+        ):
+            d = [
+                r["NamedResourceSpec"]["Value"]
+                for r in (await cls.__host_call(host, "info")).get("GenericResources")
+                or []
+                if _GPU_RESOURCE_KIND
+                in r.get("NamedResourceSpec", {}).get("Kind", "").upper()
+            ]
+        if not d:
+            # docker chooses devices (see `docker`)
+            cls.__host_gpus.pkdel(host)
+            return
+        cls.__host_gpus[host] = PKDict(
+            devices=[str(x) for x in d],
+            used=set(
+                x
+                for p in cls.__pools.values()
+                for s in p.slots
+                if s.host == host and s.gpus
+                for x in s.gpus
+            ),
+        )
+        log.info(
+            "host_gpus: host=%s devices=%s used=%s",
+            host,
+            cls.__host_gpus[host].devices,
+            sorted(cls.__host_gpus[host].used),
+        )
+
+    @classmethod
+    def __host_health_failure(cls, host, error, log):
+        """Count a failure and exclude host after host_health_failures in a row
+
+        Any call to which host responds resets the count (see
+        `__host_health_success`).
+
+        Args:
+            host (str): docker host
+            error (object): for logging
+            log (logging.Logger): logger
+        """
+        h = cls.__host_health.get(host)
+        if not h:
+            # removed (see `__host_remove`)
+            return
+        h.failures += 1
+        if h.healthy and h.failures >= cls.__cfg.host_health_failures:
+            cls.__host_health_set(host, False, error, log)
+
+    @classmethod
+    async def __host_health_loop(cls, log):
+        """Probe all hosts every host_health_secs forever
+
+        If host_health_secs is 0, only hosts which were never
+        initialized (init) are probed (every _HOST_HEALTH_SECS).
+        """
+        while True:
+            await asyncio.sleep(cls.__cfg.host_health_secs or _HOST_HEALTH_SECS)
+            await asyncio.gather(
+                *(
+                    cls.__host_health_probe(h, log)
+                    for h, v in sorted(cls.__host_health.items())
+                    if cls.__cfg.host_health_secs or v.init
+                ),
+            )
+
+    @classmethod
+    async def __host_health_probe(cls, host, log):
+        """Ping host and re-admit it if it has recovered
+
+        A probe which is still running (blocked on the host) counts
+        as a failure without starting another. An unhealthy host is
+        re-admitted by `__host_admit`, which concurrent probes share.
+
+        Args:
+            host (str): docker host
+            log (logging.Logger): logger
+        """
+        h = cls.__host_health.get(host)
+        if not h:
+            return
+        if not h.probe or h.probe.done():
+            h.probe = asyncio.create_task(cls.__host_call(host, "ping"))
+            # retrieved here unless the wait times out
+            h.probe.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(h.probe),
+                cls.__cfg.host_health_timeout_secs,
+            )
+        except Exception as e:
+            cls.__host_health_failure(host, e, log)
+            return
+        if h.healthy:
+            return
+        if not h.admit or h.admit.done():
+            h.admit = asyncio.create_task(cls.__host_admit(host, log))
+        await asyncio.shield(h.admit)
+
+    @classmethod
+    def __host_health_set(cls, host, is_healthy, error, log):
+        h = cls.__host_health.pksetdefault1(
+            host,
+            lambda: PKDict(
+                admit=None,
+                failures=0,
+                healthy=True,
+                init=False,
+                probe=None,
+                slots_from_dump=None,
+            ),
+        )
+        h.failures = 0
+        if is_healthy:
+            h.pkupdate(init=False, slots_from_dump=None)
+        _METRIC_HOST_HEALTHY.labels(host=host).set(int(is_healthy))
+        if h.healthy == is_healthy:
+            return
+        h.healthy = is_healthy
+        _METRIC_HOST_HEALTH_TRANSITIONS.labels(
+            host=host,
+            state="healthy" if is_healthy else "unhealthy",
+        ).inc()
+        if is_healthy:
+            log.info("host_health: re-admitted host=%s", host)
+        else:
+            log.error("host_health: excluded host=%s error=%s", host, error)
+
+    @classmethod
+    def __host_health_success(cls, host):
+        """Host responded so failures are no longer consecutive"""
+        h = cls.__host_health.get(host)
+        if h and h.healthy:
+            h.failures = 0
+
+    @classmethod
+    def __host_is_healthy(cls, host):
+        h = cls.__host_health.get(host)
+        return not h or h.healthy
+
+    @classmethod
+    def __host_load_failure(cls, host):
+        cls.__host_load.pksetdefault1(host, PKDict).pksetdefault1(
+            "failures", list
+        ).append(time.time())
+
+    @classmethod
+    async def __host_load_loop(cls, log):
+        """Refresh load of hosts in pools with placement=load forever"""
+        while True:
+            h = sorted(
+                set(
+                    h
+                    for p in cls.__pools.values()
+                    if p.placement == "load"
+                    for h in p.hosts
+                ),
+            )
+            await asyncio.gather(*(cls.__host_load_refresh(x, log) for x in h))
+            await asyncio.sleep(cls.__cfg.host_load_secs)
+
+    @classmethod
+    async def __host_load_refresh(cls, host, log):
+        """Measure our containers' CPU and memory use on host
+
+        cpu is the fraction of the host's CPUs used by our containers
+        since the last refresh and mem is the fraction of its memory.
+        """
+        l = cls.__host_load.pksetdefault1(host, PKDict)
+        l.pksetdefault(cpu=0.0, cpu_usage=PKDict(), failures=[], mem=0.0, running=0)
+        try:
+            i = await cls.__host_call(host, "info")
+            c = await cls.__host_call(
+                host,
+                "containers",
+                filters={"label": _PORT_LABEL, "status": "running"},
+            )
+            t = time.time()
+            u = PKDict()
+            m = 0
+            for x in c:
+                try:
+                    v = await cls.__host_call(
+                        host,
+                        "stats",
+                        x["Id"],
+                        stream=False,
+                        one_shot=True,
+                    )
+                except Exception as e:
+                    # container may have exited
+                    log.debug("host_load: stats cid=%s error=%s", x["Id"], e)
+                    continue
+                u[x["Id"]] = v["cpu_stats"]["cpu_usage"]["total_usage"]
+                m += v["memory_stats"].get("usage", 0)
+            d = t - l.get("time", t)
+            l.pkupdate(
+                cpu=(
+                    sum(max(v - l.cpu_usage.get(k, v), 0) for k, v in u.items())
+                    / (d * 1e9 * i["NCPU"])
+                    if d > 0
+                    else 0.0
+                ),
+                cpu_usage=u,
+                mem=float(m) / i["MemTotal"],
+                running=len(c),
+                time=t,
+            )
+        except Exception as e:
+            log.warning("host_load: refresh failed host=%s error=%s", host, e)
+
+    @classmethod
+    def __host_load_score(cls, host, pool):
+        """Lower is less loaded
+
+        Sums the fraction of the pool's slots on host that are running,
+        cpu and mem fractions, and one per recent spawn failure. Running
+        is at least the slots assigned now so spawns between refreshes
+        are spread.
+        """
+        a = float(cls.__host_assigned.get(host, 0))
+        n = max(cls.__pool_host_slots(pool, host), 1)
+        l = cls.__host_load.get(host)
+        if not l:
+            return a / n
+        t = time.time() - _HOST_LOAD_FAILURE_SECS
+        l.failures = [x for x in l.get("failures", []) if x > t]
+        return (
+            max(l.get("running", 0), a) / n
+            + l.get("cpu", 0.0)
+            + l.get("mem", 0.0)
+            + len(l.failures)
+        )
+
+    @classmethod
+    async def __host_image(cls, host, image, log, pull=False):
+        """Record image's id and cmd on host, pulling it if not there
+
+        Args:
+            host (str): docker host
+            image (str): image name
+            log (logging.Logger): logger
+            pull (bool): pull even if the image is on host [False]
+        Returns:
+            PKDict: id and cmd or None if failed
+        """
+        try:
+            if pull:
+                await cls.__host_call(host, "pull", *cls.__image_repo_tag(image))
+            try:
+                i = await cls.__host_call(host, "inspect_image", image)
+            except docker.errors.NotFound:
+                log.info("host_image: pulling image=%s host=%s", image, host)
+                await cls.__host_call(host, "pull", *cls.__image_repo_tag(image))
+                i = await cls.__host_call(host, "inspect_image", image)
+        except Exception as e:
+            log.warning(
+                "host_image: failed image=%s host=%s error=%s",
+                image,
+                host,
+                e,
+            )
+            return None
+        res = PKDict(
+            cmd=i["Config"]["Cmd"] or [],
+            digests=i.get("RepoDigests") or [],
+            id=i["Id"],
+        )
+        cls.__host_images.pksetdefault1(host, PKDict)[image] = res
+        if pull and cls.__image_current.get(image) != res.id:
+            log.info(
+                "host_image: current image=%s id=%s from host=%s",
+                image,
+                res.id,
+                host,
+            )
+            cls.__image_current[image] = res.id
+        return res
+
+    @classmethod
+    def __host_image_is_current(cls, host, image):
+        """Is the id of image on host the one the prefetcher pulled last?
+
+        Args:
+            host (str): docker host
+            image (str): image name
+        Returns:
+            bool: True if current, False if not on host or stale,
+                None if on host and not prefetched
+        """
+        i = cls.__host_images.get(host, PKDict()).get(image)
+        if not i:
+            return False
+        c = cls.__image_current.get(image)
+        if c is None:
+            return None
+        return c == i.id
+
+    @classmethod
+    async def __host_call(cls, host, method, *args, **kwargs):
+        """Call a docker method in host's executor (see `__host_submit`)
+
+        Args:
+            host (str): docker host
+            method (str): `docker.APIClient` method
+        Returns:
+            object: result of method
+        """
+
+        def _call():
+            try:
+                return getattr(cls.__docker_client(host), method)(*args, **kwargs)
+            except Exception as e:
+                cls.__docker_client_check(host, e)
+                raise
+
+        try:
+            res = await cls.__host_submit(host, method, _call)
+        except _Error:
+            # busy, not called
+            raise
+        except Exception as e:
+            if not cls.__host_failed(e):
+                cls.__host_health_success(host)
+            raise
+        cls.__host_health_success(host)
+        return res
+
+    @classmethod
+    async def __host_readmit(cls, host, pools, log):
+        """Unassign slots whose containers exited while host was unhealthy
+
+        Unlike `__init_host`, containers are neither assigned nor
+        removed, because spawns may be in progress (created
+        containers). Orphans are removed by `__audit`.
+
+        Args:
+            host (str): docker host
+            pools (list): pools with slots on host
+            log (logging.Logger): logger
+        Returns:
+            bool: host responded
+        """
+        try:
+            c = await asyncio.wait_for(
+                cls.__host_call(
+                    host,
+                    "containers",
+                    all=True,
+                    filters={"label": _PORT_LABEL},
+                ),
+                cls.__cfg.init_host_timeout_secs,
+            )
+        except Exception as e:
+            log.error("host_readmit: containers failed host=%s error=%s", host, e)
+            return False
+        for s in audit_host(host, (s for p in pools for s in p.slots), c).vanished:
+            cls.__events_gone(host, s.cid, s.cname, "readmit", log)
+        await cls.__host_devices_init(host, log)
+        return True
+
+    @classmethod
+    def __host_remove(cls, host, log):
+        """Forget a host which has no slots (see `__pools_reconcile`)
+
+        Args:
+            host (str): docker host
+            log (logging.Logger): logger
+        """
+        cls.__events_threads.pkdel(host)
+        e = cls.__events_streams.pkdel(host)
+        if e:
+            try:
+                # wakes the thread, which exits
+                e.close()
+            except Exception as x:
+                log.debug("host_remove: events close host=%s error=%s", host, x)
+        cls.__events_live_set(host, False)
+        for x in (
+            cls.__audit_drift,
+            cls.__containers_cache,
+            cls.__host_addrs,
+            cls.__host_assigned,
+            cls.__host_cpus,
+            cls.__host_gpus,
+            cls.__host_health,
+            cls.__host_images,
+            cls.__host_load,
+            cls.__host_resources,
+        ):
+            x.pkdel(host)
+        e = cls.__host_executors.pkdel(host)
+        if e:
+            e.executor.shutdown(wait=False)
+        with cls.__docker_clients_lock:
+            cls.__docker_clients.pkdel(host)
+        try:
+            _METRIC_HOST_HEALTHY.remove(host)
+        except KeyError:
+            pass
+        log.info("reload: removed host=%s", host)
+
+    @classmethod
+    async def __host_resources_init(cls, log, refresh=False):
+        """Discover NCPU and MemTotal of hosts in pools with per slot ratios
+
+        Hosts already discovered are skipped unless refresh (see
+        `__reload`) so a resized host's slots change on reload. Hosts
+        which fail have no slots in those pools until discovered by
+        `__reload_loop` (or keep their values if refreshing).
+
+        Args:
+            log (logging.Logger): logger
+            refresh (bool): query discovered hosts too [False]
+        Returns:
+            bool: some hosts were discovered or changed
+        """
+        h = sorted(
+            set(
+                x
+                for p in cls.__pools.values()
+                if p.cpus_per_slot or p.mem_per_slot
+                for x in p.hosts
+                if refresh or x not in cls.__host_resources
+            ),
+        )
+        res = False
+        for k, v in zip(
+            h,
+            await asyncio.gather(
+                *(cls.__host_call(x, "info") for x in h),
+                return_exceptions=True,
+            ),
+        ):
+            if isinstance(v, Exception):
+                log.error("host_resources: info failed host=%s error=%s", k, v)
+                continue
+            r = PKDict(cpus=v["NCPU"], mem=v["MemTotal"])
+            if cls.__host_resources.get(k) == r:
+                continue
+            cls.__host_resources[k] = r
+            log.info(
+                "host_resources: host=%s cpus=%s mem=%s",
+                k,
+                v["NCPU"],
+                v["MemTotal"],
+            )
+            res = True
+        return res
+
+    @classmethod
+    def __host_submit(cls, host, method, func):
+        """Run func in host's executor
+
+        Each host has its own threads (docker_host_concurrency) so a
+        hung host cannot stall calls to the others, and a burst cannot
+        overload a daemon. Calls beyond docker_host_queue_max (running
+        and waiting) are rejected.
+
+        Args:
+            host (str): docker host
+            method (str): for metrics
+            func (callable): called with no args
+        Returns:
+            asyncio.Future: result of func
+        """
+
+        def _call():
+            _METRIC_DOCKER_QUEUE_WAIT.labels(host=host).observe(time.monotonic() - t)
+            s = time.monotonic()
+            try:
+                return func()
+            finally:
+                _METRIC_DOCKER_CALL.labels(host=host, method=method).observe(
+                    time.monotonic() - s,
+                )
+
+        def _done(future):
+            with e.lock:
+                e.queued -= 1
+
+        e = cls.__host_executors.get(host)
+        if not e:
+            e = cls.__host_executors[host] = PKDict(
+                executor=concurrent.futures.ThreadPoolExecutor(
+                    max_workers=cls.__cfg.docker_host_concurrency,
+                    thread_name_prefix=f"rsdockerspawner-{host}",
+                ),
+                lock=threading.Lock(),
+                queued=0,
+            )
+        with e.lock:
+            if e.queued >= cls.__cfg.docker_host_queue_max:
+                _METRIC_DOCKER_REJECTED.labels(host=host).inc()
+                raise _Error(503, "The server is busy. Please try again later.")
+            e.queued += 1
+        t = time.monotonic()
+        f = e.executor.submit(_call)
+        # not on the asyncio future, which may be cancelled before the call ends
+        f.add_done_callback(_done)
+        return asyncio.wrap_future(f)
+
+    async def __init_class(self):
+        cls = self.__class__
+        async with cls.__class_lock:
+            if cls.__class_is_initialized:
+                return
+            # easiest way to access config generated by rsconf shared by instances
+            cls.__cfg_source = self.cfg
+            cls.__cfg_volumes = self.volumes
+            cls.__cfg.update(cls.__cfg_load())
+            cls.__images.add(self.image)
+            prometheus_client.REGISTRY.register(_Collector(cls.__metrics_slots))
+            cls.__init_volumes(self.log)
+            await cls.__init_pools(self.log)
+            atexit.register(cls.__pools_dump_flush)
+            cls.__class_is_initialized.add(True)
+
+    @classmethod
+    def __cfg_load(cls):
+        """Parse cfg (JSON or a file containing JSON) and add defaults
+
+        Returns:
+            PKDict: validated cfg
+        """
+        p = cls.__cfg_path()
+        res = cls.__fixup_cfg(
+            pkjson.load_any(p or cls.__cfg_source),
+            cls.__cfg_volumes,
+        )
+        assert res.pools, "No pools in cfg"
+        for k, v in res.get("cpu_topology", PKDict()).items():
+            assert isinstance(v, list) and all(
+                isinstance(x, list) for x in v
+            ), f"cpu_topology host={k} must be a list of lists of cpus"
+        for k, v in res.get("gpu_devices", PKDict()).items():
+            assert isinstance(v, list), f"gpu_devices host={k} must be a list"
+        d = pkio.py_path(res.tls_dir)
+        assert d.check(dir=True), "tls_dir={} does not exist".format(d)
+        res.tls_dir = d
+        res.pksetdefault(
+            audit_secs=_AUDIT_SECS,
+            docker_events=True,
+            docker_host_concurrency=_DOCKER_HOST_CONCURRENCY,
+            docker_host_queue_max=_DOCKER_HOST_QUEUE_MAX,
+            cpu_topology=PKDict(),
+            docker_max_pool_size=_DOCKER_MAX_POOL_SIZE,
+            gpu_devices=PKDict(),
+            host_addr_ttl_secs=_HOST_ADDR_TTL_SECS,
+            host_health_failures=_HOST_HEALTH_FAILURES,
+            host_health_secs=_HOST_HEALTH_SECS,
+            host_health_timeout_secs=_HOST_HEALTH_TIMEOUT_SECS,
+            host_load_secs=_HOST_LOAD_SECS,
+            image_prefetch_concurrency=_IMAGE_PREFETCH_CONCURRENCY,
+            image_prefetch_secs=0,
+            init_host_timeout_secs=_INIT_HOST_TIMEOUT_SECS,
+            poll_cache_secs=0,
+            pools_dump_secs=_POOLS_DUMP_SECS,
+            prefetch_images=[],
+            reap_max_evictions=_REAP_MAX_EVICTIONS,
+            reap_secs=_REAP_SECS,
+            reload_secs=_RELOAD_SECS,
+            remove_wait_secs=_REMOVE_WAIT_SECS,
+        )
+        return res
+
+    @classmethod
+    def __cfg_path(cls):
+        """cfg may be the name of a file (which can be reloaded)
+
+        Returns:
+            py.path: file or None if cfg is JSON
+        """
+        c = cls.__cfg_source
+        if not isinstance(c, str) or c.lstrip().startswith("{"):
+            return None
+        res = pkio.py_path(c)
+        return res if res.check(file=True) else None
+
+    @classmethod
+    async def __image_prefetch_loop(cls, log):
+        """Pull the images to every pool host every image_prefetch_secs
+
+        Pulls are bounded by image_prefetch_concurrency. Pulling an
+        image which is up to date only checks the registry.
+        """
+        l = asyncio.Semaphore(cls.__cfg.image_prefetch_concurrency)
+
+        async def _pull(host, image):
+            async with l:
+                await cls.__host_image(host, image, log, pull=True)
+
+        while True:
+            t = time.time()
+            i = sorted(cls.__images.union(cls.__cfg.prefetch_images))
+            h = sorted(set(h for p in cls.__pools.values() for h in p.hosts))
+            await asyncio.gather(*(_pull(x, y) for y in i for x in h))
+            log.info(
+                "image_prefetch: images=%d hosts=%d secs=%.3f",
+                len(i),
+                len(h),
+                time.time() - t,
+            )
+            await asyncio.sleep(cls.__cfg.image_prefetch_secs)
+
+    @classmethod
+    def __image_repo_tag(cls, image):
+        """Split like `dockerspawner.DockerSpawner.pull_image`"""
+        if ":" in image.split("/")[-1]:
+            return image.rsplit(":", 1)
+        return image, "latest"
+
+    @classmethod
+    async def __init_containers(cls, log, slots_from_dump):
+        """Assign running containers to slots and remove the others
+
+        All hosts are reconciled concurrently each with a deadline of
+        init_host_timeout_secs.
+
+        Args:
+            log (logging.Logger): logger
+            slots_from_dump (PKDict): pool name to cname to slot
+        """
+        hosts = PKDict()
+        for p in cls.__pools.values():
+            for h in p.hosts:
+                hosts.setdefault(h, []).append(p)
+        t = time.time()
+        await asyncio.gather(
+            *(
+                cls.__init_host(h, pools, log, slots_from_dump)
+                for h, pools in hosts.items()
+            ),
+        )
+        log.info(
+            "init_containers: hosts=%d secs=%.3f",
+            len(hosts),
+            time.time() - t,
+        )
+
+    @classmethod
+    def __init_cpu_quota(cls, pool):
+        if pool.cpu_limit is None:
+            pool.pkupdate(cpu_quota=None, cpu_period=None)
+            return
+        # The unreleased docker.py has "nano_cpus", which is --cpus * 1e9.
+        # Which gets converted to cpu_period and cpu_quota in Docker source:
+        # https://github.com/moby/moby/blob/ec87479/daemon/daemon_unix.go#L142
+        # Also read this:
+        # https://www.kernel.org/doc/Documentation/scheduler/sched-bwc.txt
+        # You can see the values with:
+        # id=$(docker inspect --format='{{.Id}}' jupyter-vagrant)
+        # fs=/sys/fs/cgroup/cpu/docker/$id
+        # cat $fs/cpu.cfs_period_us
+        # cat $fs/cpu.cfs_quota_us
+        pool.pkupdate(
+            cpu_period=_CPU_PERIOD_US,
+            cpu_quota=int(float(_CPU_PERIOD_US) * pool.cpu_limit),
+        )
+
+    @classmethod
+    async def __init_host(cls, host, pools, log, slots_from_dump):
+        def _assign(container, port_to_slot):
+            n = container["Names"][0]
+            i = container["Id"]
+            p, s = port_to_slot.get(int(container["Labels"][_PORT_LABEL]), (None, None))
+            log.info(
+                "init_containers: found slot=%s for cname=%s cid=%s host=%s port=%s",
+                s and s.num,
+                n,
+                i,
+                host,
+                container["Labels"][_PORT_LABEL],
+            )
+            if not s or container["State"] != "running":
+                return False
+            if s.cname:
+                # Duplicate containers with the same _PORT_LABEL
+                log.error(
+                    "init_containers: duplicate assigned cname=%s in slot=%s (trying to assign cname=%s)",
+                    s.num,
+                    s.cname,
+                    n,
+                )
+                return False
+            s2 = cls.__slot_for_container(n)[1]
+            if s2:
+                # n exists in another pool?
+                log.error(
+                    "init_containers: another slot=%s for cname=%s so removing slot=%s host=%s",
+                    s2.num,
+                    n,
+                    s.num,
+                    s.host,
+                )
+                return False
+            log.info(
+                "init_containers: assigning cname=%s to slot=%s host=%s",
+                n,
+                s.num,
+                s.host,
+            )
+            x = slots_from_dump.get(p.name, PKDict()).get(n)
+            cls.__slot_assign(p, s, n, previous_slot=x)
+            s.cid = i
+            # devices are not in the container list so trust the dump
+            s.gpus = x.gpus if x and x.host == host and x.port == s.port else None
+            return True
+
+        async def _remove(cid):
+            log.info(
+                "init_containers: removing unallocated cid=%s host=%s",
+                cid,
+                host,
+            )
+            try:
+                await cls.__host_call(host, "remove_container", cid, force=True)
+            except Exception as e:
+                log.error("init_containers: remove cid=%s failed: %s", cid, e)
+
+        t = time.time()
+        d = t + cls.__cfg.init_host_timeout_secs
+        try:
+            c = await asyncio.wait_for(
+                cls.__host_call(
+                    host,
+                    "containers",
+                    all=True,
+                    filters={"label": _PORT_LABEL},
+                ),
+                d - time.time(),
+            )
+        except Exception as e:
+            log.error(
+                "Docker error on pools=%s host=%s error=%s stack=%s ",
+                [p.name for p in pools],
+                host,
+                e,
+                pkdexc(),
+            )
+            cls.__host_health_set(host, False, e, log)
+            # containers are reconciled when re-admitted (see `__host_admit`)
+            cls.__host_health[host].pkupdate(init=True, slots_from_dump=slots_from_dump)
+            return False
+        x = PKDict()
+        for p in pools:
+            for s in p.slots:
+                if s.host == host:
+                    x.setdefault(s.port, (p, s))
+        o = [i["Id"] for i in c if _PORT_LABEL in i["Labels"] and not _assign(i, x)]
+        if o:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(_remove(i) for i in o)),
+                    max(d - time.time(), 0),
+                )
+            except asyncio.TimeoutError:
+                log.error(
+                    "init_containers: timeout removing containers host=%s",
+                    host,
+                )
+        await cls.__host_devices_init(host, log)
+        log.info(
+            "init_containers: host=%s containers=%d removed=%d secs=%.3f",
+            host,
+            len(c),
+            len(o),
+            time.time() - t,
+        )
+        return True
+
+    @classmethod
+    async def __init_host_addrs(cls, log):
+        h = sorted(set(h for p in cls.__pools.values() for h in p.hosts))
+        for k, v in zip(
+            h,
+            await asyncio.gather(
+                *(cls.__host_addr_resolve(x, log) for x in h),
+                return_exceptions=True,
+            ),
+        ):
+            if isinstance(v, Exception):
+                log.error("init_host_addrs: resolve failed host=%s error=%s", k, v)
+
+    @classmethod
+    def __init_pids_limit(cls, pool):
+        if "pids_limit" in pool:
+            return
+        if (
+            not pool.get("servers_per_host", 0)
+            or pool.cpus_per_slot
+            or pool.mem_per_slot
+        ):
+            # per host if ratios (see `__slot_resources`)
+            pool.pids_limit = None
+            return
+        pool.pids_limit = cls.__pids_avail() // pool.servers_per_host
+
+    @classmethod
+    async def __init_pools(cls, log):
+        x, cls.__users_to_pool = cls.__pools_cfg(cls.__cfg)
+        for n, p in x.items():
+            p.pkupdate(
+                lock=asyncio.Lock(),
+                # slot nums being evicted by the reaper (see `__pool_gc`)
+                reserved=set(),
+                # slot nums no longer configured (see `__pools_reconcile`)
+                retired=set(),
+                slots=[],
+            )
+            cls.__pools[n] = p
+            for h in p.hosts:
+                cls.__host_health_set(h, True, None, log)
+        await cls.__host_resources_init(log)
+        cls.__pools_reconcile(log)
+        await cls.__init_containers(log, slots_from_dump=cls.__slots_from_dump())
+        await cls.__init_host_addrs(log)
+        cls.__loops_start(log)
+        for n, p in cls.__pools.items():
+            # compact after assignments and removed hosts
+            cls.__pool_index(p)
+            log.info(
+                "pool=%s hosts=%s slots=%d slots_in_use=%d",
+                n,
+                " ".join(p.hosts),
+                len(p.slots),
+                len([x for x in p.slots if x.cname]),
+            )
+
+    @classmethod
+    def __init_volumes(cls, log):
+        res = PKDict({_DEFAULT_USER: PKDict()})
+        for s, v in cls.__cfg.volumes.items():
+            if not ("mode" in v and isinstance(v.mode, dict)):
+                res[_DEFAULT_USER][s] = copy.deepcopy(v)
+                continue
+            # rw must be first
+            for m in "rw", "ro":
+                v2 = copy.deepcopy(v)
+                if not m in v.mode:
+                    continue
+                v2.mode = m
+                for u in cls.__users_for_groups(v.mode[m]):
+                    x = res.setdefault(u, PKDict())
+                    assert (
+                        s not in x
+                    ), 'duplicate bind={} for user="{}" other={}'.format(s, u, x[s])
+                    x[s] = v2
+        cls.__users_to_volumes = res
+        cls.__users_to_binds = PKDict()
+        cls.__binds_created = set()
+        log.debug("__users_to_volumes: %s", cls.__users_to_volumes)
+
+    @classmethod
+    def __loops_start(cls, log):
+        """Start background tasks which are configured and not running"""
+
+        def _start(name, loop):
+            if name not in cls.__loops:
+                cls.__loops.add(name)
+                asyncio.create_task(loop(log))
+
+        p = cls.__pools.values()
+        if cls.__cfg.audit_secs:
+            _start("audit", cls.__audit_loop)
+        if cls.__cfg.docker_events:
+            cls.__events_start(log)
+        if cls.__cfg.host_health_secs or any(
+            h.init for h in cls.__host_health.values()
+        ):
+            _start("host_health", cls.__host_health_loop)
+        if any(x.placement == "load" for x in p):
+            _start("host_load", cls.__host_load_loop)
+        if cls.__cfg.image_prefetch_secs:
+            _start("image_prefetch", cls.__image_prefetch_loop)
+        if any(x.reap_free_slots for x in p):
+            _start("reap", cls.__reap_loop)
+        if cls.__cfg.reload_secs:
+            _start("reload", cls.__reload_loop)
+        if cls.__cfg_path() and "sighup" not in cls.__loops:
+            # inline cfg can't change so SIGHUP keeps its default action
+            cls.__loops.add("sighup")
+            try:
+                asyncio.get_running_loop().add_signal_handler(
+                    signal.SIGHUP,
+                    lambda: asyncio.create_task(cls.__reload(log)),
+                )
+            except (NotImplementedError, RuntimeError, ValueError) as e:
+                # not the main thread or not supported
+                log.info("reload: no SIGHUP handler error=%s", e)
+
+    @classmethod
+    def __pids_avail(cls):
+        """Processes containers may use (POSIT: hosts have the hub's RLIMIT_NPROC)"""
+        import resource
+
+        # Always the soft limit [0] for ordinary users
+        return resource.getrlimit(resource.RLIMIT_NPROC)[0] - _MIN_NPROC_AVAIL
+
+    def __pool_for_user(self):
+        p = self.__pools[self.__users_to_pool.get(self.user.name, _DEFAULT_POOL)]
+        if len(p.slots) == 0:
+            # If the slots are 0, then the pool is empty, and there
+            # are no allocations for this user. This could be a config
+            # error, or it could be all the servers in the pool are
+            # unavailable.
+            self.log.warn(
+                "unverified-user=%s; May not be able to talk to docker or a config error or legit unverified user",
+                self.user.name,
+            )
+            raise _Error(
+                403,
+                "sirepo-unverified: Your Sirepo account needs to be verified by our team."
+                + " Please look for an email from support@radiasoft.net",
+            )
+        return p
+
+    @classmethod
+    def __pool_gc(cls, pool, log, user=None):
+        """Claim the least active user's slot if inactive for min_activity_secs
+
+        The pool must be locked. The slot is unassigned but not free
+        (reserved if there is no user) until `__pool_gc_finish`, which
+        must be called outside the lock.
+
+        Args:
+            pool (PKDict): pool to search
+            log (logging.Logger): logger
+            user (str): new user or None if called by `__reap_loop`
+        Returns:
+            PKDict: victim (slot and its assignment) or None if no user is inactive long enough
+        """
+        s = cls.__slot_least_active(pool)
+        if s and (s.num in pool.retired or not cls.__host_is_healthy(s.host)):
+            # rare so search instead of indexing
+            s = min(
+                (
+                    x
+                    for x in pool.slots
+                    if x.cname
+                    and x.num not in pool.retired
+                    and cls.__host_is_healthy(x.host)
+                ),
+                key=lambda x: (x.activity_secs, x.num),
+                default=None,
+            )
+        if not s:
+            return None
+        t = time.time() - s.activity_secs
+        if t < pool.min_activity_secs:
+            if user:
+                log.info(
+                    "pool_gc: least active slot=%s cname=%s inactivity_secs=%s",
+                    s.num,
+                    s.cname,
+                    int(t),
+                )
+            return None
+        _METRIC_POOL_GC_EVICTIONS.labels(
+            pool=pool.name,
+            host=s.host,
+            reason="alloc" if user else "reap",
+        ).inc()
+        log.info(
+            "pool_gc: removing slot=%s cname=%s inactivity_secs=%s for %s",
+            s.num,
+            s.cname,
+            int(t),
+            f"new user={user}" if user else "reaper",
+        )
+        res = PKDict(
+            activity_secs=s.activity_secs,
+            cid=s.cid,
+            cname=s.cname,
+            slot=s,
+            start_time=s.start_time,
+        )
+        cls.__slot_unassign(s, free=False)
+        if not user:
+            pool.reserved.add(s.num)
+        # s.gpus are kept until `__pool_gc_finish` frees the slot
+        return res
+
+    @classmethod
+    async def __pool_gc_finish(cls, pool, victim, log, cname=None):
+        """Remove the victim's container and free or roll back its slot
+
+        Called outside pool.lock. On success, the slot is freed unless
+        it was assigned to cname. On failure, the victim is restored
+        to the slot, because its container may still be using the
+        port.
+
+        Args:
+            pool (PKDict): pool of slot
+            victim (PKDict): from `__pool_gc`
+            log (logging.Logger): logger
+            cname (str): container the slot was assigned to [None]
+        Returns:
+            bool: container was removed
+        """
+        s = victim.slot
+        try:
+            await cls.__host_call(s.host, "remove_container", victim.cname, force=True)
+            return True
+        except docker.errors.NotFound:
+            return True
+        except Exception as e:
+            log.error(
+                "pool_gc: remove failed: slot=%s cname=%s pool=%s host=%s error=%s",
+                s.num,
+                victim.cname,
+                pool.name,
+                s.host,
+                e,
+            )
+            if cname and s.cname == cname:
+                cls.__slot_unassign(s, free=False)
+            if s.cname or cls.__slot_for_container(victim.cname)[1]:
+                # victim was allocated another slot
+                return False
+            cls.__slot_assign(pool, s, victim.cname, previous_slot=victim)
+            s.cid = victim.cid
+            return False
+        finally:
+            pool.reserved.discard(s.num)
+            if not s.cname:
+                cls.__slot_gpus_release(s)
+                cls.__slot_free_push(pool, s)
+
+    @classmethod
+    def __pool_gpus(cls, pool):
+        """Number of GPUs per server
+
+        Args:
+            pool (PKDict): pool
+        Returns:
+            int: -1 if "all", 0 if none
+        """
+        g = pool.get("gpus")
+        if not g:
+            return 0
+        return -1 if g == "all" else int(g)
+
+    @classmethod
+    def __pool_host_slots(cls, pool, host):
+        """Number of slots for pool on host
+
+        servers_per_host unless the pool has cpus_per_slot or
+        mem_per_slot, in which case as many as fit in host's
+        resources (at most servers_per_host if not 0).
+
+        Args:
+            pool (PKDict): pool
+            host (str): docker host
+        Returns:
+            int: 0 if host's resources are not discovered
+        """
+        if not (pool.cpus_per_slot or pool.mem_per_slot):
+            return pool.servers_per_host
+        r = cls.__host_resources.get(host)
+        if not r:
+            return 0
+        res = []
+        if pool.cpus_per_slot:
+            res.append(int(r.cpus // pool.cpus_per_slot))
+        if pool.mem_per_slot:
+            res.append(int(r.mem // pool.mem_per_slot))
+        if pool.servers_per_host:
+            res.append(pool.servers_per_host)
+        return min(res)
+
+    @classmethod
+    def __pool_index(cls, pool):
+        """Rebuild pool's allocation heaps from its slots
+
+        free_slots is ordered by slot num, which is `__pools_reconcile`
+        order. active_slots is ordered by activity_secs (then num) and
+        is updated lazily (see `__slot_least_active`). Stale entries
+        in either are skipped when they reach the top. See
+        `__slot_is_free`.
 
-        # Always the soft limit [0] for ordinary users
-        pool.pids_limit = (
-            (resource.getrlimit(resource.RLIMIT_NPROC)[0] - _MIN_NPROC_AVAIL)
-        ) // pool.servers_per_host
+        Args:
+            pool (PKDict): pool to index
+        """
+        pool.free_slots = [
+            (s.num, next(cls.__heap_seq), s)
+            for s in pool.slots
+            if cls.__slot_is_free(pool, s)
+        ]
+        heapq.heapify(pool.free_slots)
+        pool.active_slots = [
+            (s.activity_secs, s.num, next(cls.__heap_seq), s.cname, s)
+            for s in pool.slots
+            if s.cname
+        ]
+        heapq.heapify(pool.active_slots)
 
     @classmethod
-    async def __init_pools(cls, log):
+    def __pool_index_compact(cls, pool):
+        if max(len(pool.free_slots), len(pool.active_slots)) > len(pool.slots) * 2 + 10:
+            cls.__pool_index(pool)
+
+    @classmethod
+    def __pools_cfg(cls, cfg):
+        """Validate cfg.pools and add defaults
+
+        Args:
+            cfg (PKDict): from `__cfg_load`
+        Returns:
+            tuple: pool name to pool (without slots) and user to pool name
+        """
         seen_user = PKDict()
 
         def _assert_user(users, n):
@@ -371,14 +2175,13 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
                 )
                 seen_user[u] = n
 
-        slot_base = 1
-        x = copy.deepcopy(cls.__cfg.pools)
-        if _DEFAULT_POOL not in x:
+        res = copy.deepcopy(cfg.pools)
+        if _DEFAULT_POOL not in res:
             # Minimal configuration for default pool, which matches nobody
-            x[_DEFAULT_POOL] = PKDict(
+            res[_DEFAULT_POOL] = PKDict(
                 hosts=[],
             )
-        for n, p in x.items():
+        for n, p in res.items():
             p.name = n
             is_default = _DEFAULT_POOL == n
             if is_default:
@@ -395,9 +2198,25 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
             p.pksetdefault(
                 cap_add=None,
                 cpu_limit=None,
+                cpu_pinning=False,
+                cpus_per_slot=None,
                 mem_limit=None,
+                mem_per_slot=None,
+                placement="ports",
+                reap_free_slots=0,
+                servers_per_host=0,
                 shm_size=None,
             )
+            assert (
+                p.placement in _PLACEMENTS
+            ), f"invalid placement={p.placement} pool={n} must be one of {_PLACEMENTS}"
+            m = p.mem_per_slot
+            if isinstance(m, str) and m[-1:].upper() in _BYTE_UNITS:
+                m = float(m[:-1]) * _BYTE_UNITS[m[-1].upper()]
+            p.mem_per_slot = int(m) if m else None
+            assert (
+                p.cpus_per_slot is None or p.cpus_per_slot > 0
+            ), f"cpus_per_slot={p.cpus_per_slot} must be positive pool={n}"
             cls.__init_pids_limit(p)
             cls.__init_cpu_quota(p)
 
@@ -409,149 +2228,313 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
                 h,
                 int(_MIN_MIN_ACTIVITY_SECS / 3600.0),
             )
-            p.slots = cls.__init_slots(p, slot_base)
-            p.lock = asyncio.Lock()
-            slot_base += len(p.slots)
-            cls.__pools[n] = p
-            await cls.__init_containers(
-                p,
-                log,
-                slots_from_dump=cls.__slots_from_dump(n),
-            )
-            log.info(
-                "pool=%s hosts=%s slots=%d slots_in_use=%d",
-                n,
-                " ".join(p.hosts),
-                len(p.slots),
-                len([x for x in p.slots if x.cname]),
-            )
+        return res, seen_user
 
     @classmethod
-    def __init_slot_find(cls, pool, host, port):
-        for s in pool.slots:
-            if s.host == host and s.port == port:
-                return s
-        return None
+    def __pools_dump(cls, log):
+        """Schedule a write of the pools to _POOLS_DUMP_FILE
+
+        Updates within pools_dump_secs are coalesced into one write,
+        which is done in an executor thread.
+
+        Args:
+            log (logging.Logger): where to log errors
+        """
+        cls.__pools_dump_dirty = True
+        if cls.__pools_dump_task is None:
+            cls.__pools_dump_task = asyncio.create_task(cls.__pools_dump_write(log))
 
     @classmethod
-    def __init_slots(cls, pool, slot_base):
-        res = []
-        c = cls.__cfg
-        for h in pool.hosts:
-            for p in range(c.port_base, c.port_base + pool.servers_per_host):
-                res.append(
-                    PKDict(
-                        activity_secs=0.0,
-                        cname=None,
-                        host=h,
-                        port=p,
-                    ),
+    def __pools_dump_file(cls, pools):
+        # rename so readers never see a partial file
+        pkio.atomic_write(_POOLS_DUMP_FILE, pkjson.dump_pretty(pools, pretty=False))
+
+    @classmethod
+    def __pools_dump_flush(cls):
+        """Write pools synchronously at exit if there are pending updates"""
+        if cls.__pools_dump_dirty:
+            cls.__pools_dump_dirty = False
+            cls.__pools_dump_file(cls.__pools_snapshot())
+
+    @classmethod
+    async def __pools_dump_write(cls, log):
+        try:
+            while cls.__pools_dump_dirty:
+                await asyncio.sleep(cls.__cfg.pools_dump_secs)
+                cls.__pools_dump_dirty = False
+                # snapshot on the event loop so it is consistent
+                await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    cls.__pools_dump_file,
+                    cls.__pools_snapshot(),
                 )
-        # sort by port first so we distribute servers across hosts
-        res = sorted(res, key=lambda x: str(x.port) + x.host)
-        for s in res:
-            s.num = slot_base
-            slot_base += 1
+        except Exception as e:
+            log.error("pools_dump: write failed error=%s stack=%s", e, pkdexc())
+        finally:
+            cls.__pools_dump_task = None
+
+    @classmethod
+    def __pools_reconcile(cls, log):
+        """Add and retire slots so pools match their hosts and slots per host (see `__pool_host_slots`)
+
+        Slots which are no longer configured are retired: they are
+        not allocated, and they are removed once free so running
+        containers are not interrupted. A slot is added when no other
+        pool has a slot with its host and port. Hosts without slots
+        are removed. Slots are numbered in port then host order so
+        servers are distributed across hosts.
+
+        Returns:
+            bool: some slots are waiting to be retired or added
+        """
+        c = cls.__cfg
+        u = PKDict()
+        n = 1
+        for p in cls.__pools.values():
+            for s in p.slots:
+                u[(s.host, s.port)] = s
+                n = max(n, s.num + 1)
+        res = False
+        for p in list(cls.__pools.values()):
+            w = set(
+                (h, x)
+                for h in p.hosts
+                for x in range(c.port_base, c.port_base + cls.__pool_host_slots(p, h))
+            )
+            x = []
+            p.retired = set()
+            for s in p.slots:
+                k = (s.host, s.port)
+                if k in w:
+                    w.remove(k)
+                elif s.cname or s.num in p.reserved:
+                    p.retired.add(s.num)
+                    res = True
+                else:
+                    del u[k]
+                    continue
+                x.append(s)
+            # sort by port first so we distribute servers across hosts
+            for k in sorted(w, key=lambda x: str(x[1]) + x[0]):
+                if k in u:
+                    # retiring in another pool
+                    res = True
+                    continue
+                u[k] = _Slot(k[0], k[1], num=n)
+                n += 1
+                x.append(u[k])
+            p.slots = x
+            cls.__pool_index(p)
+            if not p.slots and p.name != _DEFAULT_POOL and p.name not in c.pools:
+                del cls.__pools[p.name]
+                log.info("reload: removed pool=%s", p.name)
+        h = set(s.host for p in cls.__pools.values() for s in p.slots)
+        for x in list(cls.__host_health):
+            if x not in h:
+                cls.__host_remove(x, log)
         return res
 
     @classmethod
-    def __init_volumes(cls, log):
-        res = PKDict({_DEFAULT_USER: PKDict()})
-        for s, v in cls.__cfg.volumes.items():
-            if not ("mode" in v and isinstance(v.mode, dict)):
-                res[_DEFAULT_USER][s] = copy.deepcopy(v)
-                continue
-            # rw must be first
-            for m in "rw", "ro":
-                v2 = copy.deepcopy(v)
-                if not m in v.mode:
+    def __pools_snapshot(cls):
+        """Copy the pools' serializable state
+
+        Only containers which are modified in place are copied.
+
+        Returns:
+            PKDict: pool name to pool
+        """
+        res = PKDict()
+        for n, p in cls.__pools.items():
+            res[n] = PKDict((k, v) for k, v in p.items() if k not in _POOL_NO_DUMP)
+            res[n].hosts = p.hosts[:]
+            res[n].slots = [s.to_dump() for s in p.slots]
+        return res
+
+    @classmethod
+    async def __reap_loop(cls, log):
+        """Evict inactive users so pools have reap_free_slots free
+
+        Every reap_secs, each pool with reap_free_slots evicts up to
+        reap_max_evictions users inactive for min_activity_hours
+        (least active first) so spawns don't wait for `__pool_gc`.
+        """
+        while True:
+            await asyncio.sleep(cls.__cfg.reap_secs)
+            for p in cls.__pools.values():
+                if not p.reap_free_slots:
                     continue
-                v2.mode = m
-                for u in cls.__users_for_groups(v.mode[m]):
-                    x = res.setdefault(u, PKDict())
-                    assert (
-                        s not in x
-                    ), 'duplicate bind={} for user="{}" other={}'.format(s, u, x[s])
-                    x[s] = v2
-        cls.__users_to_volumes = res
-        log.debug("__users_to_volumes: %s", cls.__users_to_volumes)
+                n = p.reap_free_slots - sum(
+                    1 for s in p.slots if cls.__slot_is_free(p, s)
+                )
+                for _ in range(min(n, cls.__cfg.reap_max_evictions)):
+                    async with p.lock:
+                        v = cls.__pool_gc(p, log)
+                    if not v:
+                        break
+                    await cls.__pool_gc_finish(p, v, log)
+                    cls.__pools_dump(log)
 
-    def __pool_for_user(self):
-        u = self.user.name
-        for p in self.__pools.values():
-            if u in p.users:
-                break
-        else:
-            p = self.__pools[_DEFAULT_POOL]
-        if len(p.slots) == 0:
-            # If the slots are 0, then the pool is empty, and there
-            # are no allocations for this user. This could be a config
-            # error, or it could be all the servers in the pool are
-            # unavailable.
-            self.log.warn(
-                "unverified-user=%s; May not be able to talk to docker or a config error or legit unverified user",
-                self.user.name,
+    @classmethod
+    async def __reload(cls, log):
+        """Apply changes to cfg without interrupting running servers
+
+        Pools, hosts, servers_per_host, user_groups, and volumes are
+        diffed against the live pools (see `__pools_reconcile`). New
+        hosts are reconciled with their containers by
+        `__host_health_loop` before slots on them are allocated. The
+        resources of hosts in pools with per slot ratios are re-read. An invalid cfg is logged and ignored.
+        Only a cfg file (see `__cfg_path`) can change; inline cfg is
+        reloaded only to add discovered hosts (see `__reload_loop`).
+        """
+        async with cls.__reload_lock:
+            o = PKDict(cls.__cfg)
+            try:
+                c = cls.__cfg_load()
+                cls.__cfg.update(c)
+                x, u = cls.__pools_cfg(cls.__cfg)
+            except Exception as e:
+                cls.__cfg.clear()
+                cls.__cfg.update(o)
+                log.error("reload: invalid cfg error=%s stack=%s", e, pkdexc())
+                return
+            for k in set(o) - set(c):
+                cls.__cfg.pkdel(k)
+            h = set(s.host for p in cls.__pools.values() for s in p.slots)
+            for n, p in x.items():
+                y = cls.__pools.get(n)
+                if y:
+                    for k in set(y) - set(p) - _POOL_RUNTIME:
+                        del y[k]
+                    y.update(p)
+                    continue
+                p.pkupdate(lock=asyncio.Lock(), reserved=set(), retired=set(), slots=[])
+                cls.__pools[n] = p
+            for n, p in cls.__pools.items():
+                if n not in x:
+                    # drained and removed by __pools_reconcile
+                    p.pkupdate(
+                        cpus_per_slot=None,
+                        hosts=[],
+                        mem_per_slot=None,
+                        servers_per_host=0,
+                        users=[],
+                    )
+            cls.__users_to_pool = u
+            if (o.get("volumes"), o.get("user_groups")) != (
+                c.get("volumes"),
+                c.get("user_groups"),
+            ):
+                cls.__init_volumes(log)
+            a = sorted(set(x for p in cls.__pools.values() for x in p.hosts) - h)
+            for x in a:
+                # not allocated until __host_health_loop admits
+                cls.__host_health[x] = PKDict(
+                    admit=None,
+                    failures=0,
+                    healthy=False,
+                    init=True,
+                    probe=None,
+                    slots_from_dump=PKDict(),
+                )
+            await cls.__host_resources_init(log, refresh=True)
+            cls.__pools_reconcile(log)
+            await asyncio.gather(
+                *(cls.__host_addr_resolve(x, log) for x in a),
+                # new hosts are initialized by __init_host
+                *(
+                    f(x, log)
+                    for x in h
+                    if x in cls.__host_health
+                    for f in (cls.__host_cpus_init, cls.__host_gpus_init)
+                ),
+                return_exceptions=True,
             )
-            raise _Error(
-                403,
-                "sirepo-unverified: Your Sirepo account needs to be verified by our team."
-                + " Please look for an email from support@radiasoft.net",
+            cls.__loops_start(log)
+            cls.__pools_dump(log)
+            log.info(
+                "reload: pools=%s added_hosts=%s slots=%d",
+                " ".join(sorted(cls.__pools)),
+                " ".join(a),
+                sum(len(p.slots) for p in cls.__pools.values()),
             )
-        return p
 
-    async def __pool_gc(self, pool):
-        # all slots have names, and the pool is locked
-        s = sorted(pool.slots, key=lambda x: x.activity_secs)[0]
-        t = time.time() - s.activity_secs
-        if t < pool.min_activity_secs:
-            self.log.info(
-                "pool_gc: least active slot=%s cname=%s inactivity_secs=%s",
-                s.num,
-                s.cname,
-                int(t),
-            )
-            return None
-        self.log.info(
-            "pool_gc: removing slot=%s cname=%s inactivity_secs=%s for new user=%s",
-            s.num,
-            s.cname,
-            int(t),
-            self.user.name,
-        )
-        # No backlinks to self so clear cname to indicate slot is
-        # free. If we crash in the below, that's ok. We may have
-        # extra containers running, but we need then to poll the
-        # entire collection of containers to make sure everything
-        # is ok.
-        # TODO(robnagler) audit pools
-        cname = s.cname
-        s.cname = None
+    @classmethod
+    async def __reload_loop(cls, log):
+        """Reload when the cfg file changes or hosts are discovered and finish draining retired slots"""
+        f = cls.__cfg_path()
+        m = f and f.mtime()
+        while True:
+            await asyncio.sleep(cls.__cfg.reload_secs)
+            if f:
+                try:
+                    x = f.mtime()
+                except Exception as e:
+                    log.warning("reload: cfg=%s error=%s", f, e)
+                    continue
+                if x != m:
+                    m = x
+                    await cls.__reload(log)
+                    continue
+            if await cls.__host_resources_init(log):
+                # adds the hosts' slots
+                await cls.__reload(log)
+                continue
+            if any(p.retired for p in cls.__pools.values()):
+                async with cls.__reload_lock:
+                    if not cls.__pools_reconcile(log):
+                        log.info("reload: drained retired slots")
+                    cls.__pools_dump(log)
+
+    async def __remove_wait(self):
+        """Remove the container and wait until docker has removed it
+
+        Waits for the "destroy" event if the host's event stream is
+        live, otherwise on docker's wait (condition=removed) in an
+        executor thread. Either returns as soon as the container is
+        gone or after remove_wait_secs.
+
+        Returns:
+            bool: container was removed
+        """
+        h = self.__slot.host
+        i = self.object_id
+        f = None
+        if h in self.__events_live:
+            # before removing so the event can't be missed
+            f = self.__remove_waiters[i] = asyncio.get_running_loop().create_future()
         try:
-            m = getattr(self.__docker_client(s.host), "remove_container")
-            await self.executor.submit(m, cname, force=True)
-        except Exception as e:
-            self.log.error(
-                "pool_gc: remove failed: slot=%s cname=%s pool=%s host=%s error=%s",
-                s.num,
-                cname,
-                pool.name,
-                s.host,
+            await self.remove_object()
+            if f:
+                await asyncio.wait_for(f, self.__cfg.remove_wait_secs)
+            else:
+                await self.__host_call(
+                    h,
+                    "wait",
+                    i,
+                    timeout=self.__cfg.remove_wait_secs,
+                    condition="removed",
+                )
+            return True
+        except docker.errors.NotFound:
+            # already removed
+            return True
+        except (asyncio.TimeoutError, requests.exceptions.RequestException) as e:
+            self.log.warning(
+                "remove_wait: timed out cid=%s host=%s error=%s",
+                i[:7],
+                h,
                 e,
             )
-        return s
-
-    def __pools_dump(self):
-        pools = copy.deepcopy(self.__pools)
-        for p in pools.values():
-            p.pkdel("lock")
-        pkjson.dump_pretty(pools, filename=_POOLS_DUMP_FILE)
+            return False
+        finally:
+            self.__remove_waiters.pkdel(i)
 
     async def __slot_alloc(self, no_raise=False):
         n = self.__cname()
         if self.__slot:
             if self.__slot.cname == n:
                 # Most likely its a poll() and only case where we use last_activity
-                self.__slot.activity_secs = self.user.last_activity.timestamp()
+                self.__slot_activity(self.__slot, self.user.last_activity.timestamp())
                 self.log.debug(
                     "slot_alloc: already allocated slot=%s cname=%s inactivity_secs=%s",
                     self.__slot.num,
@@ -591,16 +2574,18 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
                 s.host,
             )
         self.__slot = s
-        self.__client = None
         # understood by dockerspawner so not needed in extra_host_config
         self.mem_limit = pool.mem_limit
         for x in _EXTRA_HOST_CONFIG:
             setattr(self, x, pool[x])
-        g = pool.get("gpus")
-        if g:
-            g = -1 if g == "all" else int(g)
-        self.__gpus = g
-        self.__pools_dump()
+        for k, v in self.__slot_resources(pool, s).items():
+            setattr(self, k, v)
+        self.__cpuset = self.__slot_cpuset(pool, s)
+        if self.__cpuset:
+            # dedicated cpus so no CFS throttling
+            self.cpu_period = self.cpu_quota = None
+        self.__gpus = self.__pool_gpus(pool)
+        self.__pools_dump(self.log)
         return True
 
     async def __slot_alloc_try(self, no_raise):
@@ -619,36 +2604,283 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
             )
 
         pool = self.__pool_for_user()
+        t = time.monotonic()
         async with pool.lock:
-            for s in pool.slots:
-                if not s.cname:
-                    break
-            else:
+            _METRIC_POOL_LOCK_WAIT.labels(pool=pool.name).observe(time.monotonic() - t)
+            v = None
+            s = self.__slot_free_pop(pool, self.image)
+            if not s:
                 if no_raise:
                     return None, None
-                s = await self.__pool_gc(pool)
-                if not s:
+                v = self.__pool_gc(pool, self.log, user=self.user.name)
+                if not v:
                     _no_slots(pool)
-            self.__slot_assign(s, self.__cname())
-            return s, pool
+                s = v.slot
+            # reserved so the eviction can complete outside the lock
+            self.__slot_assign(pool, s, self.__cname())
+            if not self.__slot_gpus_assign(pool, s) and not v:
+                # placement skips hosts without free devices so inventory changed
+                self.__slot_unassign(s)
+                _no_slots(pool)
+        if v and not (
+            await self.__pool_gc_finish(pool, v, self.log, cname=self.__cname())
+        ):
+            _no_slots(pool)
+        return s, pool
+
+    @classmethod
+    def __slot_activity(cls, slot, activity_secs):
+        p = slot.activity_secs
+        slot.activity_secs = activity_secs
+        if activity_secs < p:
+            # active_slots entries must not be larger than activity_secs
+            i = cls.__cname_to_slot[slot.cname]
+            heapq.heappush(
+                i[0].active_slots,
+                (activity_secs, slot.num, next(cls.__heap_seq), slot.cname, slot),
+            )
+            cls.__pool_index_compact(i[0])
 
     @classmethod
-    def __slot_assign(cls, slot, cname, previous_slot=None):
+    def __slot_assign(cls, pool, slot, cname, previous_slot=None):
+        if not slot.cname:
+            cls.__host_assigned[slot.host] = cls.__host_assigned.get(slot.host, 0) + 1
         slot.cname = cname
+        slot.cid = None
+        cls.__cname_to_slot[cname] = (pool, slot)
         if previous_slot:
             slot.activity_secs = previous_slot.activity_secs
             slot.start_time = previous_slot.start_time
         else:
             slot.activity_secs = time.time()
             slot.start_time = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        heapq.heappush(
+            pool.active_slots,
+            (slot.activity_secs, slot.num, next(cls.__heap_seq), cname, slot),
+        )
+        cls.__pool_index_compact(pool)
+        if _CHECK_INDEXES:
+            cls.__slot_index_check()
+
+    @classmethod
+    def __slot_cpuset(cls, pool, slot):
+        """cpuset_cpus and cpuset_mems for slot if pool has cpu_pinning
+
+        The host's cpus are divided evenly among its ports (the
+        most slots of the pools on the host) in NUMA
+        node order so a slot's cpus are fixed by its port and on as
+        few nodes as possible.
+
+        Args:
+            pool (PKDict): pool of slot
+            slot (_Slot): assigned slot
+        Returns:
+            PKDict: host config or None if not pinned (or fewer cpus than ports)
+        """
+        t = cls.__host_cpus.get(slot.host)
+        if not pool.cpu_pinning or not t:
+            return None
+        n = max(
+            cls.__pool_host_slots(p, slot.host)
+            for p in cls.__pools.values()
+            if slot.host in p.hosts
+        )
+        i = slot.port - cls.__cfg.port_base
+        w = len(t.cpus) // n if n else 0
+        if not w or i >= n:
+            # retired slots are not pinned
+            return None
+        c = t.cpus[i * w : (i + 1) * w]
+        res = PKDict(cpuset_cpus=",".join(str(x) for x, _ in c))
+        if t.numa:
+            res.cpuset_mems = ",".join(str(x) for x in sorted(set(x for _, x in c)))
+        return res
 
     @classmethod
     def __slot_for_container(cls, cname):
+        return cls.__cname_to_slot.get(cname, (None, None))
+
+    @classmethod
+    def __slot_free_pop(cls, pool, image):
+        """Remove first unassigned slot in pool.slots order (or by load)
+
+        When prefetching, slots on hosts with the current image are
+        preferred. Slots on hosts without enough free GPUs are skipped.
+
+        Args:
+            pool (PKDict): pool to search
+            image (str): image to be started
+        Returns:
+            PKDict: slot or None if all are assigned
+        """
+        if pool.placement == "load":
+            return cls.__slot_free_least_loaded(pool, image)
+        x = []
+        g = []
+        res = None
+        while pool.free_slots:
+            e = heapq.heappop(pool.free_slots)
+            if not cls.__slot_is_free(pool, e[-1]):
+                # pushed or re-indexed when it becomes free
+                continue
+            if not cls.__slot_gpus_available(pool, e[-1]):
+                g.append(e)
+                continue
+            if not cls.__cfg.image_prefetch_secs or cls.__host_image_is_current(
+                e[-1].host,
+                image,
+            ):
+                res = e[-1]
+                break
+            x.append(e)
+        if x and not res:
+            res = x.pop(0)[-1]
+        for e in x + g:
+            heapq.heappush(pool.free_slots, e)
+        return res
+
+    @classmethod
+    def __slot_free_least_loaded(cls, pool, image):
+        """First unassigned slot on the least loaded host
+
+        When prefetching, hosts with the current image come first.
+        Entries are not removed from free_slots, because they are
+        stale once the slot is assigned.
+
+        Args:
+            pool (PKDict): pool to search
+            image (str): image to be started
+        Returns:
+            PKDict: slot or None if all are assigned
+        """
+        res = None
+        k = None
+        h = PKDict()
+        for e in pool.free_slots:
+            s = e[-1]
+            if not cls.__slot_is_free(pool, s) or not cls.__slot_gpus_available(
+                pool, s
+            ):
+                continue
+            if s.host not in h:
+                h[s.host] = (
+                    bool(cls.__cfg.image_prefetch_secs)
+                    and not cls.__host_image_is_current(s.host, image),
+                    cls.__host_load_score(s.host, pool),
+                )
+            x = (h[s.host], s.num)
+            if k is None or x < k:
+                res = s
+                k = x
+        return res
+
+    @classmethod
+    def __slot_gpus_assign(cls, pool, slot):
+        """Assign free devices on slot's host if pool has gpus
+
+        A slot taken from an inactive user keeps the user's devices.
+
+        Args:
+            pool (PKDict): pool of slot
+            slot (_Slot): assigned slot
+        Returns:
+            bool: False if there are not enough free devices
+        """
+        n = cls.__pool_gpus(pool)
+        g = cls.__host_gpus.get(slot.host)
+        if n <= 0 or not g:
+            cls.__slot_gpus_release(slot)
+            return True
+        if slot.gpus and len(slot.gpus) == n:
+            return True
+        cls.__slot_gpus_release(slot)
+        f = [d for d in g.devices if d not in g.used]
+        if len(f) < n:
+            return False
+        slot.gpus = tuple(f[:n])
+        g.used.update(slot.gpus)
+        return True
+
+    @classmethod
+    def __slot_gpus_available(cls, pool, slot):
+        """Slot's host has enough free devices for pool (see `__slot_gpus_assign`)"""
+        n = cls.__pool_gpus(pool)
+        g = cls.__host_gpus.get(slot.host)
+        if n <= 0 or not g:
+            return True
+        return sum(1 for d in g.devices if d not in g.used) >= n
+
+    @classmethod
+    def __slot_gpus_release(cls, slot):
+        if not slot.gpus:
+            return
+        g = cls.__host_gpus.get(slot.host)
+        if g:
+            g.used.difference_update(slot.gpus)
+        slot.gpus = None
+
+    @classmethod
+    def __slot_is_free(cls, pool, slot):
+        """Slot can be allocated
+
+        Not assigned, not being evicted by the reaper, still
+        configured, and on a healthy host.
+        """
+        return (
+            not slot.cname
+            and slot.num not in pool.reserved
+            and slot.num not in pool.retired
+            and cls.__host_is_healthy(slot.host)
+        )
+
+    @classmethod
+    def __slot_least_active(cls, pool):
+        """Find assigned slot with the smallest activity_secs
+
+        Entries are refreshed when they reach the top, which works,
+        because `__slot_activity` pushes an entry when activity_secs
+        decreases.
+
+        Args:
+            pool (PKDict): pool to search
+        Returns:
+            PKDict: slot (not removed) or None if none assigned
+        """
+        h = pool.active_slots
+        while h:
+            a, n, _, c, s = h[0]
+            if s.cname != c:
+                # freed or reassigned (which pushed its own entry)
+                heapq.heappop(h)
+            elif s.activity_secs != a:
+                heapq.heapreplace(h, (s.activity_secs, n, next(cls.__heap_seq), c, s))
+            else:
+                return s
+        return None
+
+    @classmethod
+    def __slot_index_check(cls):
+        """Assert __cname_to_slot and __host_assigned match the slots"""
+        x = PKDict()
+        h = PKDict()
         for p in cls.__pools.values():
             for s in p.slots:
-                if s.cname == cname:
-                    return p, s
-        return None, None
+                if s.cname:
+                    assert s.cname not in x, f"duplicate cname={s.cname}"
+                    x[s.cname] = (p, s)
+                    h[s.host] = h.get(s.host, 0) + 1
+        assert h == PKDict(
+            (k, v) for k, v in cls.__host_assigned.items() if v
+        ), f"assigned slots={h} index={cls.__host_assigned}"
+        assert x.keys() == cls.__cname_to_slot.keys(), (
+            f"cnames slots={sorted(x.keys())}"
+            + f" index={sorted(cls.__cname_to_slot.keys())}"
+        )
+        for k, v in x.items():
+            i = cls.__cname_to_slot[k]
+            assert (
+                i[0] is v[0] and i[1] is v[1]
+            ), f"cname={k} slot={v[1].num} index={i[1].num}"
 
     def __slot_free(self):
         if not self.__slot:
@@ -660,27 +2892,76 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
             self.user.name,
             self.__slot.host,
         )
-        self.__client = None
         if self.__cname() == self.__slot.cname:
             # Might have been garbage collected
-            self.__slot.cname = None
+            self.__slot_unassign(self.__slot)
         self.__slot = None
-        self.__pools_dump()
+        self.__pools_dump(self.log)
+
+    @classmethod
+    def __slot_free_push(cls, pool, slot):
+        heapq.heappush(pool.free_slots, (slot.num, next(cls.__heap_seq), slot))
+        cls.__pool_index_compact(pool)
 
     @classmethod
-    def __slots_from_dump(cls, pool_name):
+    def __slot_resources(cls, pool, slot):
+        """Limits for slot from its host's share if pool has per slot ratios
+
+        The host's cpus, memory, and processes are divided by the
+        pool's slots on the host (see `__pool_host_slots`), which is
+        at least cpus_per_slot and mem_per_slot.
+
+        Args:
+            pool (PKDict): pool of slot
+            slot (_Slot): assigned slot
+        Returns:
+            PKDict: spawner attributes to override (may be empty)
+        """
+        res = PKDict()
+        r = cls.__host_resources.get(slot.host)
+        n = cls.__pool_host_slots(pool, slot.host)
+        if not (pool.cpus_per_slot or pool.mem_per_slot) or not r or not n:
+            return res
+        if pool.cpus_per_slot:
+            res.pkupdate(
+                cpu_period=_CPU_PERIOD_US,
+                cpu_quota=int(float(_CPU_PERIOD_US) * r.cpus / n),
+            )
+        if pool.mem_per_slot:
+            res.mem_limit = r.mem // n
+        if pool.pids_limit is None:
+            res.pids_limit = cls.__pids_avail() // n
+        return res
+
+    @classmethod
+    def __slot_unassign(cls, slot, free=True):
+        if not slot.cname:
+            return
+        i = cls.__cname_to_slot.get(slot.cname)
+        if i and i[1] is slot:
+            del cls.__cname_to_slot[slot.cname]
+        cls.__host_assigned[slot.host] -= 1
+        slot.cname = None
+        slot.cid = None
+        if free:
+            cls.__slot_gpus_release(slot)
+            if i and i[1] is slot:
+                cls.__slot_free_push(i[0], slot)
+        if _CHECK_INDEXES:
+            cls.__slot_index_check()
+
+    @classmethod
+    def __slots_from_dump(cls):
         p = pkio.py_path(_POOLS_DUMP_FILE)
         if not p.exists():
             return PKDict()
-        slots = PKDict()
-        for s in (
-            pkjson.load_any(p).pkunchecked_nested_get(
-                f"{pool_name}.slots",
-            )
-            or []
-        ):
-            slots[s.cname] = s
-        return slots
+        res = PKDict()
+        for n, v in pkjson.load_any(p).items():
+            res[n] = PKDict()
+            for s in v.get("slots") or []:
+                if s.cname:
+                    res[n][s.cname] = _Slot.from_dump(s)
+        return res
 
     @classmethod
     def __users_for_groups(cls, groups):
@@ -701,43 +2982,188 @@ class RSDockerSpawner(dockerspawner.DockerSpawner):
 
     async def start(self, *args, **kwargs):
         """copied from dockerspawner and trimmed"""
-        await self.pull_image(self.image)
-        obj = await self.get_object()
-        if obj:
-            self.log.info(
-                "Removing existing %s: %s (id: %s)",
-                self.object_type,
-                self.object_name,
-                self.object_id[:7],
-            )
-            await self.remove_object()
-            for _ in range(10):
+        try:
+            with self.__metrics_phase("slot_alloc"):
+                await self.__slot_alloc()
+            with self.__metrics_phase("pull_image"):
+                await self.pull_image(self.image)
+            with self.__metrics_phase("get_object"):
                 obj = await self.get_object()
-                if not obj:
-                    break
-                await asyncio.sleep(1)
-            else:
-                self.log.error(
-                    "Remove failed %s: %s (id: %s); will try to start anyway",
+            if obj:
+                self.log.info(
+                    "Removing existing %s: %s (id: %s)",
                     self.object_type,
                     self.object_name,
                     self.object_id[:7],
                 )
-        obj = await self.create_object()
-        self.object_id = obj[self.object_id_key]
-        self.log.info(
-            "Starting %s %s (id: %s) from image %s",
-            self.object_type,
-            self.object_name,
-            self.object_id[:7],
-            self.image,
-        )
-        await self.start_object()
-        ip, port = await self.get_ip_and_port()
-        return (ip, port)
+                with self.__metrics_phase("remove_object"):
+                    if await self.__remove_wait():
+                        # remove_object freed the slot
+                        await self.__slot_alloc()
+                    elif await self.get_object():
+                        self.log.error(
+                            "Remove failed %s: %s (id: %s); will try to start anyway",
+                            self.object_type,
+                            self.object_name,
+                            self.object_id[:7],
+                        )
+            with self.__metrics_phase("create_object"):
+                obj = await self.create_object()
+            self.object_id = obj[self.object_id_key]
+            self.log.info(
+                "Starting %s %s (id: %s) from image %s",
+                self.object_type,
+                self.object_name,
+                self.object_id[:7],
+                self.image,
+            )
+            with self.__metrics_phase("start_object"):
+                await self.start_object()
+            ip, port = await self.get_ip_and_port()
+            return (ip, port)
+        except _Error:
+            raise
+        except Exception as e:
+            if self.__slot:
+                if self.__host_failed(e):
+                    self.__host_health_failure(self.__slot.host, e, self.log)
+                self.__host_load_failure(self.__slot.host)
+                # image may have been removed from the host
+                self.__host_images.pkdel(self.__slot.host)
+            raise
+
+
+def audit_host(host, slots, containers):
+    """Compare host's labeled containers with the slots assigned to them
+
+    Used by `RSDockerSpawner` and `rsdockerspawner.pkcli.audit`. A
+    container matches a slot with its name and port, which has no
+    cid (being spawned) or the container's. A matched container
+    must be created or running.
+
+    Args:
+        host (str): docker host
+        slots (iterable): `_Slot` (any host, see `_Slot.from_dump`)
+        containers (list): from `docker.APIClient.containers` with _PORT_LABEL
+    Returns:
+        PKDict: orphans (containers) and vanished (slots whose containers are gone or exited)
+    """
+    s = PKDict()
+    for x in slots:
+        if x.host == host and x.cname:
+            s[x.cname] = x
+    m = set()
+    res = PKDict(orphans=[], vanished=[])
+    for c in containers:
+        x = s.get(c["Names"][0])
+        if (
+            x
+            and str(x.port) == c["Labels"].get(_PORT_LABEL)
+            and x.cid in (None, c["Id"])
+            and c["State"] in _AUDIT_LIVE_STATES
+        ):
+            m.add(c["Id"])
+        else:
+            res.orphans.append(c)
+    res.vanished = [x for x in s.values() if x.cid and x.cid not in m]
+    return res
+
+
+def docker_client(host, tls_dir, max_pool_size=_DOCKER_MAX_POOL_SIZE):
+    """Connect to host's docker daemon with certs in tls_dir/host
+
+    Args:
+        host (str): docker host
+        tls_dir (py.path): contains a directory per host with _TLS_FILES
+        max_pool_size (int): connections kept alive
+    Returns:
+        docker.APIClient: new client
+    """
+    d = tls_dir.join(host)
+    t = docker.tls.TLSConfig(
+        client_cert=(str(d.join("cert.pem")), str(d.join("key.pem"))),
+        ca_cert=str(d.join("cacert.pem")),
+        verify=True,
+    )
+    return docker.APIClient(
+        version="auto",
+        base_url="tcp://{}:2376".format(host),
+        max_pool_size=max_pool_size,
+        tls=t,
+    )
+
+
+class _Collector:
+    """Adapts a function to a `prometheus_client` collector"""
+
+    def __init__(self, collect):
+        self.collect = collect
 
 
 class _Error(tornado.web.HTTPError):
     def __init__(self, code, msg):
         super().__init__(code, msg)
         self.jupyterhub_message = msg
+
+
+class _Slot:
+    """A server's host and port and the container assigned to it
+
+    Pools may have thousands so attributes are fixed. The dump format
+    is a dict of the attributes (see `to_dump`).
+    """
+
+    __slots__ = (
+        "activity_secs",
+        "cid",
+        "cname",
+        "gpus",
+        "host",
+        "num",
+        "port",
+        "start_time",
+    )
+
+    def __init__(self, host, port, num=None):
+        self.activity_secs = 0.0
+        self.cid = None
+        self.cname = None
+        self.gpus = None
+        self.host = host
+        self.num = num
+        self.port = port
+        self.start_time = None
+
+    @classmethod
+    def from_dump(cls, value):
+        """Slot from `to_dump`
+
+        Args:
+            value (dict): from _POOLS_DUMP_FILE
+        Returns:
+            _Slot: new
+        """
+        res = cls(value["host"], value["port"], num=value.get("num"))
+        for k in "activity_secs", "cid", "cname", "start_time":
+            if value.get(k) is not None:
+                setattr(res, k, value[k])
+        if value.get("gpus"):
+            res.gpus = tuple(value["gpus"])
+        return res
+
+    def to_dump(self):
+        """Attributes for _POOLS_DUMP_FILE
+
+        Returns:
+            PKDict: attribute names to values
+        """
+        return PKDict(
+            activity_secs=self.activity_secs,
+            cid=self.cid,
+            cname=self.cname,
+            gpus=self.gpus and list(self.gpus),
+            host=self.host,
+            num=self.num,
+            port=self.port,
+            start_time=self.start_time,
+        )
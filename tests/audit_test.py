@@ -0,0 +1,116 @@
+"""Comparison of slots with containers by audit_host and the audit command
+
+:copyright: Copyright (c) 2026 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+
+from pykern.pkcollections import PKDict
+
+_HOST = "h1"
+
+
+def test_audit_host():
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    s = [
+        _slot(8100, "/jupyter-a", cid="a1"),
+        # being spawned
+        _slot(8101, "/jupyter-b"),
+        _slot(8102, "/jupyter-c", cid="c1"),
+        _slot(8103, "/jupyter-d", cid="d1"),
+        # other hosts are ignored
+        _slot(8100, "/jupyter-e", cid="e1", host="h2"),
+    ]
+    c = [
+        _container("a1", "/jupyter-a", 8100),
+        _container("b1", "/jupyter-b", 8101, state="created"),
+        # exited
+        _container("c1", "/jupyter-c", 8102, state="exited"),
+        # d1 was replaced by an unknown container
+        _container("d2", "/jupyter-d", 8103),
+        _container("x1", "/jupyter-x", 8104),
+    ]
+    r = rsdockerspawner.audit_host(_HOST, s, c)
+    pkunit.pkeq(["c1", "d2", "x1"], [x["Id"] for x in r.orphans])
+    pkunit.pkeq(["/jupyter-c", "/jupyter-d"], [x.cname for x in r.vanished])
+
+
+def test_audit_host_port():
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    r = rsdockerspawner.audit_host(
+        _HOST,
+        [_slot(8100, "/jupyter-a")],
+        [_container("a1", "/jupyter-a", 8101)],
+    )
+    pkunit.pkeq(["a1"], [x["Id"] for x in r.orphans])
+    # no cid so not known to be gone
+    pkunit.pkeq([], r.vanished)
+
+
+def test_default_command(monkeypatch, tmp_path):
+    from pykern import pkjson
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+    from rsdockerspawner.pkcli import audit
+
+    f = tmp_path.joinpath("pools.json")
+    # written before slots had cid and gpus
+    pkjson.dump_pretty(
+        PKDict(
+            everybody=PKDict(
+                hosts=[_HOST],
+                servers_per_host=2,
+                slots=[
+                    PKDict(
+                        activity_secs=1.0,
+                        cname="/jupyter-a",
+                        host=_HOST,
+                        num=1,
+                        port=8100,
+                    ),
+                    PKDict(activity_secs=0.0, cname=None, host=_HOST, num=2, port=8101),
+                ],
+            ),
+        ),
+        filename=str(f),
+    )
+    monkeypatch.setattr(
+        rsdockerspawner,
+        "docker_client",
+        lambda host, tls_dir: PKDict(
+            containers=lambda **kwargs: [
+                _container("a1", "/jupyter-a", 8100),
+                _container("x1", "/jupyter-x", 8101),
+            ],
+        ),
+    )
+    pkunit.pkeq(
+        [
+            "orphan host=h1 cname=/jupyter-x cid=x1 port=8101 state=running",
+            "hosts=1 slots=2 orphans=1 vanished=0 errors=0",
+        ],
+        audit.default_command(str(tmp_path), pools_file=str(f)).split("\n"),
+    )
+
+
+def _container(cid, cname, port, state="running"):
+    from rsdockerspawner import rsdockerspawner
+
+    return PKDict(
+        Id=cid,
+        Labels={rsdockerspawner._PORT_LABEL: str(port)},
+        Names=[cname],
+        State=state,
+    )
+
+
+def _slot(port, cname, cid=None, host=_HOST):
+    from rsdockerspawner import rsdockerspawner
+
+    res = rsdockerspawner._Slot(host, port)
+    res.cname = cname
+    res.cid = cid
+    return res
@@ -0,0 +1,619 @@
+"""Slot allocation and eviction against the bench's fake docker hosts
+
+:copyright: Copyright (c) 2026 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+
+from pykern.pkcollections import PKDict
+
+
+def test_alloc_order():
+    from pykern import pkunit
+
+    async def _run(b):
+        return [await b.spawner(f"u{i}").start() for i in range(b.capacity)]
+
+    b = _bench(hosts=2, servers_per_host=2)
+    # first free port on every host before the next port (like the original scan)
+    pkunit.pkeq(
+        [
+            ("127.0.0.1", 8100),
+            ("127.0.0.2", 8100),
+            ("127.0.0.1", 8101),
+            ("127.0.0.2", 8101),
+        ],
+        b.execute(_run),
+    )
+
+
+def test_cname_index():
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    async def _run(b):
+        c = rsdockerspawner.RSDockerSpawner
+        i = c._RSDockerSpawner__cname_to_slot
+        await _start_inactive(b, "old", 5)
+        p = c._RSDockerSpawner__pools.everybody
+        a = b.spawner("a")
+        pkunit.pkeq(("127.0.0.1", 8101), await a.start())
+        pkunit.pkeq(("127.0.0.1", 8101), _host_port(i["/jupyter-a"][1]))
+        pkunit.pkeq(p, i["/jupyter-a"][0])
+        # old's slot is reassigned by gc so its entry moves
+        pkunit.pkeq(("127.0.0.1", 8100), await b.spawner("new").start())
+        pkunit.pkeq(["/jupyter-a", "/jupyter-new"], sorted(i.keys()))
+        await a.stop()
+        pkunit.pkeq(["/jupyter-new"], list(i.keys()))
+        pkunit.pkeq(
+            (None, None),
+            c._RSDockerSpawner__slot_for_container("/jupyter-a"),
+        )
+        # the check catches an index which does not match the slots
+        i["/jupyter-a"] = i["/jupyter-new"]
+        with pkunit.pkexcept(AssertionError):
+            c._RSDockerSpawner__slot_index_check()
+
+    _bench(hosts=1, servers_per_host=2).execute(_run)
+
+
+def test_cpuset():
+    from pykern import pkunit
+
+    def _cpuset(bench, user):
+        for h in bench.hosts.values():
+            for c in h._containers.values():
+                if c.Name == f"/jupyter-{user}":
+                    return (
+                        c.HostConfig.get("cpuset_cpus"),
+                        c.HostConfig.get("cpuset_mems"),
+                    )
+        pkunit.pkfail("user={} not found", user)
+
+    async def _run(b):
+        for i in range(b.capacity):
+            await b.spawner(f"u{i}").start()
+        return [_cpuset(b, f"u{i}") for i in range(b.capacity)]
+
+    pkunit.pkeq(
+        # alternating hosts in port order (see test_alloc_order)
+        [
+            # each port gets the same cpus on as few NUMA nodes as possible
+            ("0,2", "0"),
+            # discovered from NCPU so memory nodes are unknown
+            ("0,1,2,3,4,5,6,7", None),
+            ("4,6", "0"),
+            ("8,9,10,11,12,13,14,15", None),
+            ("1,3", "1"),
+            ("16,17,18,19,20,21,22,23", None),
+            ("5,7", "1"),
+            ("24,25,26,27,28,29,30,31", None),
+        ],
+        _bench(
+            hosts=2,
+            servers_per_host=4,
+            extra_cfg=PKDict(
+                cpu_topology=PKDict({"127.0.0.1": [[0, 2, 4, 6], [1, 3, 5, 7]]}),
+            ),
+            pool=PKDict(cpu_pinning=True),
+        ).execute(_run),
+    )
+
+
+def test_events_gone():
+    import asyncio
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    async def _wait(op, msg):
+        for _ in range(100):
+            if op():
+                return
+            await asyncio.sleep(0.02)
+        pkunit.pkfail(msg)
+
+    async def _run(b):
+        c = rsdockerspawner.RSDockerSpawner
+        i = c._RSDockerSpawner__cname_to_slot
+        h = b.hosts["127.0.0.1"]
+        s = PKDict((u, b.spawner(u)) for u in ("a", "b"))
+        for x in s.values():
+            await x.start()
+        await _wait(
+            lambda: "127.0.0.1" in c._RSDockerSpawner__events_live,
+            "events stream not live",
+        )
+        n = h.calls
+        # served without docker calls while the stream is live
+        pkunit.pkeq(None, await s.b.poll())
+        pkunit.pkeq(n, h.calls)
+        # a container b replaced, which must not free b's slot
+        h._event(PKDict(Id="old", Labels=PKDict(), Name="/jupyter-b"), "destroy")
+        h.stop(i["/jupyter-a"][1].cid)
+        await _wait(lambda: "/jupyter-a" not in i, "slot not freed by die event")
+        pkunit.pkeq(("127.0.0.1", 8101), _host_port(i["/jupyter-b"][1]))
+        pkunit.pkeq(("127.0.0.1", 8100), await b.spawner("c").start())
+
+    _bench(hosts=1, servers_per_host=2, docker_events=True).execute(_run)
+
+
+def test_gc_least_active():
+    from pykern import pkunit
+
+    async def _run(b):
+        p = PKDict()
+        for u, h in ("o1", 2), ("o2", 5), ("o3", 3):
+            p[u] = await _start_inactive(b, u, h)
+        pkunit.pkeq(p.o2, await b.spawner("new").start())
+        return _running(b, "o1", "o2", "o3", "new")
+
+    pkunit.pkeq(
+        PKDict(o1=1, o2=0, o3=1, new=1),
+        _bench(hosts=1, servers_per_host=3).execute(_run),
+    )
+
+
+def test_gc_remove_failure():
+    from pykern import pkunit
+
+    async def _run(b):
+        h = b.hosts["127.0.0.1"]
+        o1 = await _start_inactive(b, "o1", 5)
+        await _start_inactive(b, "o2", 2)
+        r = h.remove_container
+
+        def _fail(*args, **kwargs):
+            raise h._error(500, "fake remove failure")
+
+        h.remove_container = _fail
+        with pkunit.pkexcept("no more servers"):
+            await b.spawner("new").start()
+        pkunit.pkeq(1, _running(b, "o1").o1)
+        h.remove_container = r
+        # o1 was restored with its activity so it is still the victim
+        pkunit.pkeq(o1, await b.spawner("new").start())
+        return _running(b, "o1", "o2", "new")
+
+    pkunit.pkeq(
+        PKDict(o1=0, o2=1, new=1),
+        _bench(hosts=1, servers_per_host=2).execute(_run),
+    )
+
+
+def test_host_addr():
+    import asyncio
+    import socket
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    r = PKDict(addr="10.0.0.1", calls=0, error=None)
+
+    async def _getaddrinfo(host, *args, **kwargs):
+        r.calls += 1
+        if r.error:
+            raise socket.gaierror(r.error)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (r.addr, 0))]
+
+    async def _refresh(spawner, addr):
+        # expired, so the refresh is started in the background
+        addr.expires = 0
+        pkunit.pkeq(("10.0.0.1", 8100), await spawner.get_ip_and_port())
+        await addr.task
+
+    async def _run(b):
+        asyncio.get_running_loop().getaddrinfo = _getaddrinfo
+        s = b.spawner("a")
+        await s.start()
+        a = rsdockerspawner.RSDockerSpawner._RSDockerSpawner__host_addrs["127.0.0.1"]
+        c = r.calls
+        r.addr = "10.0.0.2"
+        # cached until host_addr_ttl_secs
+        pkunit.pkeq(("10.0.0.1", 8100), await s.get_ip_and_port())
+        pkunit.pkeq(c, r.calls)
+        r.error = "fake resolver failure"
+        await _refresh(s, a)
+        # stale address is kept and retried after _HOST_ADDR_RETRY_SECS
+        pkunit.pkeq(c + 1, r.calls)
+        pkunit.pkok(a.expires > 0, "retry not scheduled expires={}", a.expires)
+        pkunit.pkeq(("10.0.0.1", 8100), await s.get_ip_and_port())
+        pkunit.pkeq(c + 1, r.calls)
+        r.error = None
+        await _refresh(s, a)
+        pkunit.pkeq(("10.0.0.2", 8100), await s.get_ip_and_port())
+
+    _bench(hosts=1, servers_per_host=1).execute(_run)
+
+
+def test_host_admit():
+    import asyncio
+    import requests
+    import time
+    from pykern import pkjson
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    async def _run(b):
+        c = rsdockerspawner.RSDockerSpawner
+        h = b.hosts["127.0.0.2"]
+        g = h.gpus[0]
+        o = h.container_add("jupyter-old", 8100)
+        o.HostConfig = PKDict(DeviceRequests=[PKDict(DeviceIDs=[g])])
+        t = float(int(time.time()))
+        pkjson.dump_pretty(
+            PKDict(
+                everybody=PKDict(
+                    slots=[
+                        PKDict(
+                            activity_secs=t,
+                            cid=o.Id,
+                            cname="/jupyter-old",
+                            gpus=[g],
+                            host=h.host,
+                            num=2,
+                            port=8100,
+                            start_time="2026-01-01T00:00:00Z",
+                        ),
+                    ],
+                ),
+            ),
+            filename=rsdockerspawner._POOLS_DUMP_FILE,
+        )
+        r = h.containers
+
+        def _fail(*args, **kwargs):
+            raise requests.exceptions.ConnectionError("fake down")
+
+        h.containers = _fail
+        pkunit.pkeq(("127.0.0.1", 8100), await b.spawner("u0").start())
+        h.containers = r
+        # e.g. __host_health_loop and a probe which was started earlier
+        await asyncio.gather(
+            *(c._RSDockerSpawner__host_health_probe(h.host, b._log) for _ in range(2)),
+        )
+        pkunit.pkeq(1, _running(b, "old").old)
+        s = c._RSDockerSpawner__cname_to_slot["/jupyter-old"][1]
+        pkunit.pkeq(
+            (h.host, 8100, o.Id, (g,), t),
+            (s.host, s.port, s.cid, s.gpus, s.activity_secs),
+        )
+        # the only GPUs are used by u0 and old, which is too active to evict
+        with pkunit.pkexcept("no more servers"):
+            await b.spawner("u1").start()
+
+    _bench(hosts=2, servers_per_host=2, gpus=1, gpus_per_host=1).execute(_run)
+
+
+def test_host_slots():
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    def _slots(**kwargs):
+        p = PKDict(cpus_per_slot=None, mem_per_slot=None, servers_per_host=0)
+        return rsdockerspawner.RSDockerSpawner._RSDockerSpawner__pool_host_slots(
+            p.pkupdate(kwargs),
+            "127.0.0.1",
+        )
+
+    async def _run(b):
+        c = rsdockerspawner.RSDockerSpawner
+        s = b.spawner("a")
+        await s.start()
+        p = c._RSDockerSpawner__pools.everybody
+        # fewest of 32 cpus / 6 and 64G / 16G
+        pkunit.pkeq(4, len(p.slots))
+        # the host's share, which is at least the ratios
+        pkunit.pkeq((800000, 16 << 30), (s.cpu_quota, s.mem_limit))
+        pkunit.pkeq(3, _slots(servers_per_host=3))
+        pkunit.pkeq(8, _slots(cpus_per_slot=4))
+        pkunit.pkeq(2, _slots(cpus_per_slot=4, mem_per_slot=32 << 30))
+        # servers_per_host is a maximum
+        pkunit.pkeq(5, _slots(cpus_per_slot=1, servers_per_host=5))
+        c._RSDockerSpawner__host_resources.pkdel("127.0.0.1")
+        # not discovered
+        pkunit.pkeq(0, _slots(cpus_per_slot=4))
+
+    _bench(
+        hosts=1,
+        servers_per_host=0,
+        pool=PKDict(cpus_per_slot=6, mem_per_slot="16G"),
+    ).execute(_run)
+
+
+def test_load_spread():
+    from pykern import pkunit
+
+    async def _run(b):
+        for i, h in enumerate(list(b.hosts.values())[1:]):
+            h.container_add(f"jupyter-pre{i}", 8100)
+        for i in range(12):
+            await b.spawner(f"u{i}").start()
+        return sorted(h.running("") for h in b.hosts.values())
+
+    # spawns between load refreshes see the slots assigned since
+    pkunit.pkeq(
+        [3, 4, 4, 4],
+        _bench(hosts=4, servers_per_host=8, pool=PKDict(placement="load")).execute(
+            _run
+        ),
+    )
+
+
+def test_poll_cache():
+    import asyncio
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    def _count(host, method, error=None):
+        f = getattr(host, method)
+
+        def _call(*args, **kwargs):
+            n[method] += 1
+            if error:
+                raise host._error(500, error)
+            return f(*args, **kwargs)
+
+        setattr(host, method, _call)
+
+    async def _run(b):
+        c = rsdockerspawner.RSDockerSpawner
+        h = b.hosts["127.0.0.1"]
+        s = PKDict((u, b.spawner(u)) for u in ("a", "b"))
+        for x in s.values():
+            await x.start()
+        _count(h, "containers")
+        _count(h, "inspect_container")
+        # one listing shared by concurrent polls
+        pkunit.pkeq([None, None], await asyncio.gather(*(x.poll() for x in s.values())))
+        pkunit.pkeq(PKDict(containers=1, inspect_container=0), n)
+        s.c = b.spawner("c")
+        await s.c.start()
+        n.pkupdate(containers=0, inspect_container=0)
+        # not in the listing so inspected
+        pkunit.pkeq(None, await s.c.poll())
+        pkunit.pkeq(PKDict(containers=0, inspect_container=1), n)
+        h.stop(c._RSDockerSpawner__cname_to_slot["/jupyter-a"][1].cid)
+        e = c._RSDockerSpawner__containers_cache["127.0.0.1"]
+        e.expires = 0
+        n.pkupdate(containers=0, inspect_container=0)
+        # listed as exited so inspected for the exit status
+        pkunit.pkok(await s.a.poll() is not None, "a not stopped")
+        pkunit.pkeq(PKDict(containers=1, inspect_container=1), n)
+        e.expires = 0
+        _count(h, "containers", error="fake containers failure")
+        n.pkupdate(containers=0, inspect_container=0)
+        # listing failed so inspected
+        pkunit.pkeq(None, await s.b.poll())
+        pkunit.pkeq(PKDict(containers=1, inspect_container=1), n)
+
+    n = PKDict(containers=0, inspect_container=0)
+    _bench(hosts=1, servers_per_host=3, poll_cache_secs=60).execute(_run)
+
+
+def test_reap_reserved():
+    import asyncio
+    import threading
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    async def _run(b):
+        h = b.hosts["127.0.0.1"]
+        o1 = await _start_inactive(b, "o1", 5)
+        await b.spawner("active").start()
+        entered = threading.Event()
+        release = threading.Event()
+        r = h.remove_container
+
+        def _block(*args, **kwargs):
+            entered.set()
+            release.wait(10)
+            return r(*args, **kwargs)
+
+        h.remove_container = _block
+        for _ in range(100):
+            if entered.is_set():
+                break
+            await asyncio.sleep(0.05)
+        else:
+            pkunit.pkfail("reaper did not evict o1")
+        # o1's slot is reserved while the reaper removes its container
+        # and must stay reserved when free_slots is rebuilt (e.g. a host is readmitted)
+        p = rsdockerspawner.RSDockerSpawner._RSDockerSpawner__pools.everybody
+        rsdockerspawner.RSDockerSpawner._RSDockerSpawner__pool_index(p)
+        with pkunit.pkexcept("no more servers"):
+            await b.spawner("new").start()
+        release.set()
+        for _ in range(100):
+            if not p.reserved:
+                break
+            await asyncio.sleep(0.05)
+        h.remove_container = r
+        pkunit.pkeq(0, _running(b, "o1").o1)
+        pkunit.pkeq(o1, await b.spawner("new").start())
+        return b.running()
+
+    pkunit.pkeq(
+        2,
+        _bench(
+            hosts=1,
+            servers_per_host=2,
+            extra_cfg=PKDict(reap_secs=0.05),
+            pool=PKDict(reap_free_slots=1),
+        ).execute(_run),
+    )
+
+
+def test_reload_invalid():
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    async def _run(b):
+        p = rsdockerspawner.RSDockerSpawner._RSDockerSpawner__pools
+        await b.spawner("a").start()
+        await _reload(
+            b,
+            lambda c: c.pools.everybody.pkupdate(placement="bogus", servers_per_host=1),
+        )
+        # logged and ignored
+        pkunit.pkeq(("ports", 2), (p.everybody.placement, len(p.everybody.slots)))
+        pkunit.pkeq(("127.0.0.1", 8101), await b.spawner("b").start())
+
+    _bench(hosts=1, servers_per_host=2, cfg_file=True).execute(_run)
+
+
+def test_reload_pools():
+    import asyncio
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    def _add(cfg):
+        cfg.pools.everybody.hosts.append("127.0.0.2")
+        cfg.pools.vip = PKDict(
+            hosts=["127.0.0.1"],
+            min_activity_hours=1,
+            servers_per_host=3,
+            user_groups=["vip"],
+        )
+        cfg.user_groups = PKDict(vip=["v1"])
+
+    def _remove(cfg):
+        del cfg.pools["vip"]
+        cfg.user_groups = PKDict()
+
+    async def _run(b):
+        c = rsdockerspawner.RSDockerSpawner
+        p = c._RSDockerSpawner__pools
+        b.hosts["127.0.0.2"].container_add("jupyter-pre", 8100)
+        pkunit.pkeq(("127.0.0.1", 8100), await b.spawner("a").start())
+        await _reload(b, _add)
+        # pools on a host share its ports so vip only gets the one everybody doesn't have
+        pkunit.pkeq([("127.0.0.1", 8102)], [(s.host, s.port) for s in p.vip.slots])
+        v = b.spawner("v1")
+        pkunit.pkeq(("127.0.0.1", 8102), await v.start())
+        for _ in range(100):
+            if c._RSDockerSpawner__host_health["127.0.0.2"].healthy:
+                break
+            await asyncio.sleep(0.05)
+        else:
+            pkunit.pkfail("added host was not admitted")
+        # pre was running on the added host so it keeps its slot
+        pkunit.pkeq(
+            ("127.0.0.2", 8100),
+            _host_port(c._RSDockerSpawner__cname_to_slot["/jupyter-pre"][1]),
+        )
+        pkunit.pkeq(("127.0.0.1", 8101), await b.spawner("u1").start())
+        pkunit.pkeq(("127.0.0.2", 8101), await b.spawner("u2").start())
+        await _reload(b, _remove)
+        # drained: v1 is not interrupted
+        pkunit.pkeq((1, [8102]), (_running(b, "v1").v1, [s.port for s in p.vip.slots]))
+        await v.stop()
+        pkunit.pkeq(False, c._RSDockerSpawner__pools_reconcile(b._log))
+        pkunit.pkok("vip" not in p, "vip not removed pools={}", list(p))
+        pkunit.pkeq(1, _running(b, "pre").pre)
+
+    _bench(
+        hosts=2,
+        servers_per_host=2,
+        cfg_file=True,
+        extra_cfg=PKDict(host_health_secs=0.05),
+        pool=PKDict(hosts=["127.0.0.1"]),
+    ).execute(_run)
+
+
+def test_reload_resized():
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    async def _run(b):
+        p = rsdockerspawner.RSDockerSpawner._RSDockerSpawner__pools
+        h = b.hosts["127.0.0.1"]
+        await b.spawner("a").start()
+        pkunit.pkeq(4, len(p.everybody.slots))
+        i = h.info
+        h.info = lambda: PKDict(i(), NCPU=64)
+        await _reload(b, lambda c: None)
+        pkunit.pkeq(8, len(p.everybody.slots))
+
+    # fake hosts have 32 cpus
+    _bench(
+        hosts=1,
+        servers_per_host=0,
+        cfg_file=True,
+        pool=PKDict(cpus_per_slot=8),
+    ).execute(_run)
+
+
+def test_reload_retire():
+    from pykern import pkunit
+    from rsdockerspawner import rsdockerspawner
+
+    async def _run(b):
+        c = rsdockerspawner.RSDockerSpawner
+        p = c._RSDockerSpawner__pools
+        s = PKDict((u, b.spawner(u)) for u in ("a", "b"))
+        for x in s.values():
+            await x.start()
+        await _reload(b, lambda c: c.pools.everybody.pkupdate(servers_per_host=1))
+        # b's slot is retired, but b is not interrupted
+        pkunit.pkeq(1, _running(b, "b").b)
+        with pkunit.pkexcept("no more servers"):
+            await b.spawner("c").start()
+        await s.b.stop()
+        # see __reload_loop
+        pkunit.pkeq(False, c._RSDockerSpawner__pools_reconcile(b._log))
+        pkunit.pkeq([8100], [x.port for x in p.everybody.slots])
+        with pkunit.pkexcept("no more servers"):
+            await b.spawner("c").start()
+
+    _bench(hosts=1, servers_per_host=2, cfg_file=True).execute(_run)
+
+
+def _bench(**kwargs):
+    """Fresh spawner class, because its state is per process"""
+    import importlib
+    import prometheus_client
+    from rsdockerspawner import rsdockerspawner
+    from rsdockerspawner.pkcli import bench
+
+    r = prometheus_client.REGISTRY
+    for c, n in list(r._collector_to_names.items()):
+        if any(x.startswith("rsdockerspawner") for x in n):
+            r.unregister(c)
+    importlib.reload(rsdockerspawner)
+    return bench._Bench(
+        latency=0,
+        failure_rate=0,
+        min_activity_hours=1,
+        **kwargs,
+    )
+
+
+def _host_port(slot):
+    return (slot.host, slot.port)
+
+
+async def _reload(bench, op):
+    """Change bench's cfg file with op and reload"""
+    from pykern import pkio
+    from pykern import pkjson
+    from rsdockerspawner import rsdockerspawner
+
+    c = pkjson.load_any(pkio.py_path(bench.cfg))
+    op(c)
+    pkjson.dump_pretty(c, filename=bench.cfg)
+    await rsdockerspawner.RSDockerSpawner._RSDockerSpawner__reload(bench._log)
+
+
+def _running(bench, *users):
+    return PKDict((u, bench.running(f"jupyter-{u}")) for u in users)
+
+
+async def _start_inactive(bench, user, hours):
+    import datetime
+
+    s = bench.spawner(
+        user,
+        last_activity=datetime.datetime.now() - datetime.timedelta(hours=hours),
+    )
+    res = await s.start()
+    # sets activity_secs from last_activity
+    await s.poll()
+    return res